@@ -1,17 +1,438 @@
+import os
+import json
+import time
+import functools
+import operator
+import types
+import threading
+import copy
+import itertools
 import numpy as np
 import matplotlib as plt
 import pandas as pd
-import locale
 import matplotlib.pyplot as plt
 import matplotlib.ticker as tick
-from operator import itemgetter
+import matplotlib.patches as patches
+from io import BytesIO
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from concurrent.futures import ProcessPoolExecutor
+
+# Caches a Budget method's result per instance, keyed by its arguments | the cache is dropped whenever the instance's inputs differ
+# from the snapshot it was filled with, and is only created by the first call, so plain attribute assignment stays free
+def memoize(method):
+
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            key = (method.__name__, TaxTables.version, args, tuple(sorted(kwargs.items())))
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+
+        # Any input change since the cache was filled (salary, necessity_pct, freq, ...) invalidates it
+        state = self.snapshot(self)
+        try:
+            cache = self.cache
+            if self.cache_state != state:
+                cache.clear()
+                self.cache_state = state
+        except AttributeError:
+            cache = self.cache = {}
+            self.cache_state = state
+        if key in cache:
+            self.cache_hits += 1
+            return cache[key]
+        self.cache_misses += 1
+        value = method(self, *args, **kwargs)
+        cache[key] = value
+        return value
+    wrapper.memoized = True
+    return wrapper
+
+class TaxTables():
+
+    # Tax rules index keyed by (tax year, jurisdiction, filing status), built once per process from every registered source and shared
+    # by every Budget instance | jurisdiction 'US' and the state codes hold (n, 3) float arrays of [rate, min, max] bracket rows,
+    # 'FICA' and 'LIMITS' hold dicts of Social Security/Medicare constants and retirement contribution limits
+    tables = {}
+    resolved = {}
+    years = {}
+    checked = set()
+    version = 0
+    built = False
+    folder = os.path.dirname(os.path.abspath(__file__))
+    sources = {2021: os.path.join(folder, 'fed_income_tax_2021.csv'),
+               2022: os.path.join(folder, 'fed_income_tax_2022.csv'),
+               2023: os.path.join(folder, 'fed_income_tax_2023.csv'),
+               2024: os.path.join(folder, 'fed_income_tax_2024.csv'),
+               'states': os.path.join(folder, 'state_income_tax.csv'),
+               'rules': os.path.join(folder, 'tax_rules.csv')}
+
+    # Filing (Key) 1 - Single, 2 - Married Filing Jointly/Qualifying Widow, 3 - Head of Household, 4 - Married Filing Separately
+    filing_dict = {1: ('Single_Min','Single_Max'), 2: ('MFJ_Min','MFJ_Max'), 3: ('HOH_Min','HOH_Max'), 4: ('MFS_Min','MFS_Max')}
+    fica_fields = ('ss_tax_rate', 'ss_max', 'mcr_tax_rate_1', 'mcr_tax_rate_2', 'mcr_breakpoint')
+    limit_fields = ('r_401k_limit', 'r_roth_ira_limit', 'r_hsa_limit', 'roth_ira_earnings_limit')
+    pia_fields = ('pia_bend_1', 'pia_bend_2')
+    pia_rates = (0.90, 0.32, 0.15)
+    kinds = ('US', 'FICA', 'LIMITS', 'PIA')
+
+    # Registers a source (.csv, .parquet, .xlsx path, DataFrame or dict) and drops the index so it is rebuilt on next use
+    # key is a tax year for federal brackets, 'states' for Year/State/Filing/Rate/Min/Max rows or 'rules' for Year/Filing rows
+    # of fica_fields, limit_fields and (optionally) the Social Security pia_fields bend points
+    @classmethod
+    def SetSource(cls, key, source):
+        cls.sources[key] = source
+        cls.version += 1
+        cls.tables.clear()
+        cls.resolved.clear()
+        cls.years.clear()
+        cls.checked.clear()
+        cls.built = False
+
+    # Reads a source into a DataFrame
+    @staticmethod
+    def Read(source):
+        if isinstance(source, pd.DataFrame):
+            return source
+        if isinstance(source, dict):
+            return pd.DataFrame(source)
+        ext = os.path.splitext(source)[1].lower()
+        if ext == '.csv':
+            return pd.read_csv(source)
+        if ext == '.parquet':
+            return pd.read_parquet(source)
+        return pd.read_excel(source)
+
+    # Reads one source into the index
+    @classmethod
+    def Load(cls, key):
+        df = cls.Read(cls.sources[key])
+        if key == 'states':
+            for (year, state, filing), rows in df.groupby(['Year', 'State', 'Filing'], sort=False):
+                table = rows[['Rate', 'Min', 'Max']].to_numpy(dtype=np.float64)
+                cls.tables[(int(year), state, int(filing))] = np.ascontiguousarray(table)
+        elif key == 'rules':
+            for row in df.to_dict('records'):
+                year, filing = int(row['Year']), int(row['Filing'])
+                cls.tables[(year, 'FICA', filing)] = {field: float(row[field]) for field in cls.fica_fields}
+                cls.tables[(year, 'LIMITS', filing)] = {field: float(row[field]) for field in cls.limit_fields}
+                if all(field in row for field in cls.pia_fields):
+                    bend_1, bend_2 = (float(row[field]) for field in cls.pia_fields)
+                    table = [[cls.pia_rates[0], 0, bend_1], [cls.pia_rates[1], bend_1, bend_2], [cls.pia_rates[2], bend_2, 100000000000]]
+                    cls.tables[(year, 'PIA', filing)] = np.array(table)
+        else:
+            for filing, columns in cls.filing_dict.items():
+                if columns[0] in df.columns and columns[1] in df.columns:
+                    table = df[['Rate', columns[0], columns[1]]].to_numpy(dtype=np.float64)
+                    cls.tables[(key, 'US', filing)] = np.ascontiguousarray(table)
+
+    # Loads every registered source and indexes the tax years on file per (jurisdiction, filing status)
+    @classmethod
+    def Build(cls):
+        for key in cls.sources:
+            cls.Load(key)
+        for year, jurisdiction, filing in cls.tables:
+            cls.years.setdefault((jurisdiction, filing), []).append(year)
+        for years in cls.years.values():
+            years.sort()
+        cls.built = True
+
+    # Installs an index built by another process, e.g. as a ProcessPoolExecutor initializer so workers never re-read sources
+    @classmethod
+    def Share(cls, tables):
+        cls.tables.update(tables)
+        cls.resolved.clear()
+        cls.years.clear()
+        cls.checked.clear()
+        for year, jurisdiction, filing in cls.tables:
+            cls.years.setdefault((jurisdiction, filing), []).append(year)
+        for years in cls.years.values():
+            years.sort()
+        cls.built = True
+
+    # Returns the entry for a tax year, jurisdiction and filing status | years without their own rules use the latest earlier year
+    # on file (the earliest for years before it), so forecasts can look up any future year; each key is resolved once
+    @classmethod
+    def Lookup(cls, year, jurisdiction, filing):
+        key = (year, jurisdiction, filing)
+        try:
+            return cls.resolved[key]
+        except KeyError:
+            pass
+
+        if not cls.built:
+            cls.Build()
+        years = cls.years.get((jurisdiction, int(filing)))
+        if not years:
+            raise ValueError('No %s tax rules for filing status %s; states on file: %s (add others with TaxTables.SetSource)'
+                             % (jurisdiction, filing, ', '.join(cls.States())))
+        on_file = years[max(np.searchsorted(years, int(year), side='right') - 1, 0)]
+        cls.resolved[key] = cls.tables[(on_file, jurisdiction, int(filing))]
+        return cls.resolved[key]
+
+    # Returns the bracket table for a tax year, filing status and jurisdiction ('US' for federal or a state code)
+    @classmethod
+    def Get(cls, year=2021, filing=1, jurisdiction='US'):
+        return cls.Lookup(year, jurisdiction, filing)
+
+    # Returns the 'FICA' or 'LIMITS' constants, or the 'PIA' bend point bracket table, for a tax year and filing status
+    @classmethod
+    def Rules(cls, year=2021, kind='FICA', filing=1):
+        return cls.Lookup(year, kind, filing)
+
+    # Returns the sorted codes of the states with brackets on file
+    @classmethod
+    def States(cls):
+        if not cls.built:
+            cls.Build()
+        return sorted({key[0] for key in cls.years if key[0] not in cls.kinds})
+
+    # Raises ValueError unless every rule a household needs (federal and state brackets, FICA and limits) is on file
+    # The bundled sources hold 2021-2024 federal rules and the states in state_income_tax.csv: CA brackets plus the flat-rate and
+    # no-income-tax states. Other graduated-rate states (NY, NJ, OR, MN, GA, OH, VA, ...) are not bundled and are rejected here, at
+    # Budget, Batch, Drawdown and IncrementalForecast construction, until their brackets are registered with SetSource('states', ...)
+    @classmethod
+    def Check(cls, year, filing, state):
+        if (year, filing, state) in cls.checked:
+            return
+        for jurisdiction in ('US', state, 'FICA', 'LIMITS'):
+            cls.Lookup(year, jurisdiction, filing)
+        cls.checked.add((year, filing, state))
+
+class TaxEngine():
+
+    # Applies a bracket table to an array of annual incomes | progressive=False taxes the whole income at its top bracket rate like Budget does
+    @staticmethod
+    def Brackets(table, annual_taxable, progressive=True):
+        income = np.maximum(np.asarray(annual_taxable, dtype=np.float64), 0)
+        rates = table[:, 0]
+        edges = table[:-1, 2]
+        idx = np.searchsorted(edges, income, side='left')
+
+        if not progressive:
+            return rates[idx] * income
+
+        # Bracket i starts where bracket i-1 ends and owes the full tax of every bracket below it
+        lower = np.concatenate(([0.0], edges))
+        base = np.concatenate(([0.0], np.cumsum(rates[:-1] * np.diff(lower))))
+        return base[idx] + rates[idx] * (income - lower[idx])
+
+    # Calls func(income, *key) once per distinct combination of keys (filing status, state, tax year, ...) broadcast against the
+    # incomes and scatters the results back | keys that hold a single value are passed through as scalars without grouping
+    @staticmethod
+    def Grouped(func, annual_taxable, *keys):
+        keys = [np.asarray(key).flat[0] if np.size(key) > 1 and (np.asarray(key) == np.asarray(key).flat[0]).all() else key for key in keys]
+        keys = [np.asarray(key).flat[0] if np.size(key) == 1 else key for key in keys]
+        if all(np.ndim(key) == 0 for key in keys):
+            return func(annual_taxable, *keys)
+
+        income, *keys = np.broadcast_arrays(np.asarray(annual_taxable, dtype=np.float64), *keys)
+        groups = pd.DataFrame({i: key.ravel() for i, key in enumerate(keys)}).groupby(list(range(len(keys))), sort=False).indices
+        flat = income.ravel()
+        out = None
+        for group, rows in groups.items():
+            value = func(flat[rows], *(group if isinstance(group, tuple) else (group,)))
+            if out is None:
+                out = np.empty(np.shape(value)[:-1] + flat.shape)
+            out[..., rows] = value
+        return out.reshape(out.shape[:-1] + income.shape)
+
+    # Returns federal income tax for an array of annual taxable incomes, divided by freq (1 = annual)
+    # filing and year may be scalars or arrays that broadcast against the incomes
+    @classmethod
+    def Federal(cls, annual_taxable, filing=1, year=2021, freq=1, progressive=True):
+        return cls.Grouped(lambda income, filing, year: cls.Brackets(TaxTables.Get(year, filing), income, progressive),
+                           annual_taxable, filing, year) / freq
+
+    # Returns state income tax for an array of annual taxable incomes, divided by freq (1 = annual)
+    # Same argument order as Federal with the state inserted after the incomes
+    @classmethod
+    def State(cls, annual_taxable, state='CA', filing=1, year=2021, freq=1, progressive=True):
+        return cls.Grouped(lambda income, state, filing, year: cls.Brackets(TaxTables.Get(year, filing, state), income, progressive),
+                           annual_taxable, state, filing, year) / freq
+
+    # Returns Social Security and Medicare tax arrays, applying the SS wage cap and the Medicare surtax with masks
+    @classmethod
+    def FICA(cls, annual_taxable, filing=1, year=2021, freq=1):
+
+        def Compute(income, filing, year):
+            rules = TaxTables.Rules(year, 'FICA', filing)
+            income = np.maximum(np.asarray(income, dtype=np.float64), 0)
+            ss_tax = np.where(income > rules['ss_max'], rules['ss_max'], income) * rules['ss_tax_rate']
+            surtax = income > rules['mcr_breakpoint']
+            mcr_tax = income * rules['mcr_tax_rate_1']
+            mcr_tax = np.where(surtax, mcr_tax + (income - rules['mcr_breakpoint']) * (rules['mcr_tax_rate_2'] - rules['mcr_tax_rate_1']), mcr_tax)
+            return np.stack((ss_tax, mcr_tax))
+
+        ss_tax, mcr_tax = cls.Grouped(Compute, annual_taxable, filing, year)
+        return ss_tax / freq, mcr_tax / freq
+
+class Result():
+
+    # Base for the fixed-field results of the Budget methods | values live in __slots__ named by fields, and a record still
+    # indexes, slices, unpacks and converts like the tuple it replaces, e.g. r[6] is r.r_401k and t.Convert(r) works as before
+    __slots__ = ()
+    fields = ()
+
+    def __init__(self, *values):
+        if len(values) != len(self.fields):
+            raise ValueError('%s takes %d values, got %d' % (type(self).__name__, len(self.fields), len(values)))
+        for field, value in zip(self.fields, values):
+            object.__setattr__(self, field, value)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(getattr(self, field) for field in self.fields[index])
+        return getattr(self, self.fields[index])
+
+    def __iter__(self):
+        return (getattr(self, field) for field in self.fields)
+
+    def __len__(self):
+        return len(self.fields)
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other) if isinstance(other, (Result, tuple)) else NotImplemented
+
+    def __repr__(self):
+        return '%s(%s)' % (type(self).__name__, ', '.join('%s=%r' % (field, getattr(self, field)) for field in self.fields))
+
+    def __array__(self, dtype=None, copy=None):
+        return np.array(tuple(self), dtype=dtype)
+
+    def __reduce__(self):
+        return (type(self), tuple(self))
+
+    # Returns {field: value}
+    def AsDict(self):
+        return {field: getattr(self, field) for field in self.fields}
+
+class RecommendationResult(Result):
+
+    # Per-paycheck budget from Budget.BudgetRecommendation
+    fields = ('gross_pay', 'f_tax', 'ss_tax', 'mcr_tax', 's_tax', 'rent', 'r_401k', 'r_roth_ira', 'r_hsa', 'leisure', 'max_rent', 'max_car')
+    __slots__ = fields
+
+class NetWorthResult(Result):
+
+    # Future values at retirement from Budget.NetWorth
+    fields = ('total', 'fv_401k', 'fv_roth_ira', 'fv_hsa', 'fv_other')
+    __slots__ = fields
+
+class RetirementIncomeResult(Result):
+
+    # Monthly retirement income from Budget.RetirementIncome
+    fields = ('gross_monthly', 'monthly_taxes', 'net_monthly')
+    __slots__ = fields
+
+class ForecastResult():
+
+    # Year-by-year balances from Budget.Forecast held in one (years, 4) float array | still reads like the {year: (other, 401k,
+    # ROTH IRA, HSA)} dict it replaces (f[3], f.keys(), f.items(), len(f)) and converts to NumPy or pandas without copying
+    __slots__ = ('array',)
+    fields = ('other', 'r_401k', 'r_roth_ira', 'r_hsa')
+
+    def __init__(self, array):
+        self.array = array
+
+    def __getitem__(self, year):
+        if not 0 <= year < len(self.array):
+            raise KeyError(year)
+        return tuple(self.array[year].tolist())
+
+    def __iter__(self):
+        return iter(range(len(self.array)))
+
+    def __len__(self):
+        return len(self.array)
+
+    def __contains__(self, year):
+        return 0 <= year < len(self.array)
+
+    def __eq__(self, other):
+        if isinstance(other, ForecastResult):
+            return np.array_equal(self.array, other.array)
+        return dict(self.items()) == other if isinstance(other, dict) else NotImplemented
+
+    def __repr__(self):
+        return 'ForecastResult(%r)' % dict(self.items())
+
+    def __array__(self, dtype=None, copy=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def keys(self):
+        return range(len(self.array))
+
+    def values(self):
+        return [tuple(row) for row in self.array.tolist()]
+
+    def items(self):
+        return list(zip(self.keys(), self.values()))
+
+    # Returns the balances as a (years, vehicles) DataFrame sharing the array's memory
+    def ToFrame(self):
+        return pd.DataFrame(self.array, columns=list(self.fields), copy=False)
+
+class ResultColumns():
+
+    # Columnar results of a Batch method | a (fields, households[, years]) float64 array, one contiguous row per field, so a field
+    # is a zero-copy view and ToFrame hands the same memory to pandas. Indexes by position or name like the tuple of arrays it
+    # replaces (r[6], r['r_401k'], r.r_401k) and Row(i) returns one household's record
+    __slots__ = ('record', 'data')
+
+    def __init__(self, record, columns):
+        self.record = record
+        self.data = columns if isinstance(columns, np.ndarray) else np.stack(np.broadcast_arrays(*columns)).astype(np.float64, copy=False)
+
+    @property
+    def fields(self):
+        return self.record.fields
+
+    def __getitem__(self, index):
+        if isinstance(index, str):
+            return self.data[self.fields.index(index)]
+        if isinstance(index, slice):
+            return tuple(self.data[index])
+        return self.data[index]
+
+    def __getattr__(self, name):
+        if name in ResultColumns.__slots__ or name not in self.record.fields:
+            raise AttributeError(name)
+        return self.data[self.record.fields.index(name)]
+
+    def __iter__(self):
+        return iter(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.data if dtype is None else self.data.astype(dtype)
+
+    # Returns household i's results as a record
+    def Row(self, i):
+        return self.record(*self.data[:, i].tolist())
+
+    # Returns a (households, fields) DataFrame sharing the array's memory (one-dimensional fields only)
+    def ToFrame(self, index=None):
+        return pd.DataFrame(self.data.T, index=index, columns=list(self.fields), copy=False)
 
 class Budget():
 
+    # Model inputs | memoized results are only valid for the snapshot of these they were computed with
+    inputs = ('salary', 'freq', 'health_ins', 'current_loans', 'current_401k', 'current_roth', 'current_hsa', 'current_other',
+              'necessity_pct', 'annual_s_return', 'annual_b_return', 'stocks', 'bonds', 'annual_blended_return', 'inflation', 'salary_inc',
+              'savings_rate', 'years_worked', 'years_to_retirement', 'years_to_live', 'filing', 'state', 'tax_year')
+    __slots__ = ('cache', 'cache_state', 'cache_hits', 'cache_misses') + inputs
+    snapshot = operator.attrgetter(*inputs)
+
     def __init__(self, salary, years_worked, years_to_retirement, years_to_live, necessity_pct, freq=26, health_ins=0, current_loans=0, 
                  current_401k=0, current_roth=0, current_hsa=0, current_other=0, s_return=0.07, b_return=0.02, stocks=0.9, bonds=0.1, inflation=0.02, 
-                 salary_inc=0.02, savings_rate=0.50):
+                 salary_inc=0.02, savings_rate=0.50, filing=1, state='CA', tax_year=2021):
 
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.salary = salary
         self.freq = freq
         self.health_ins = health_ins
@@ -32,6 +453,23 @@ class Budget():
         self.years_worked = years_worked
         self.years_to_retirement = years_to_retirement
         self.years_to_live = years_to_live
+        self.filing = filing
+        self.state = state
+        self.tax_year = tax_year
+        if (tax_year, filing, state) not in TaxTables.checked:
+            TaxTables.Check(tax_year, filing, state)
+
+    # Drops the memoized results
+    def ClearCache(self):
+        try:
+            self.cache.clear()
+        except AttributeError:
+            pass
+
+    # Returns hit/miss counters for the memoized methods
+    def CacheInfo(self):
+        fresh = getattr(self, 'cache_state', None) == self.snapshot(self)
+        return {'hits': self.cache_hits, 'misses': self.cache_misses, 'size': len(self.cache) if fresh else 0}
     
     # Estimate returns of 401k, ROTH IRA, HSA, and other investments based on biweekly contributions
     def NetWorth(self, r_401k, r_roth, r_hsa, other, current_401k=0, current_roth=0, current_hsa=0, current_other=0):
@@ -44,46 +482,19 @@ class Budget():
         fv_hsa = round(Tools.FVA(self, r_hsa, n, r), 2)
         fv_other = round(Tools.FVA(self, other, n, r), 2)
         total = fv_401k + fv_roth_ira + fv_hsa + fv_other
-        return total, fv_401k, fv_roth_ira, fv_hsa, fv_other
-
-    # Forecast value of each vehicle year by year
-    def Forecast(self):
-        years = {}
-
-        # Initialize starting point
-        current_salary = self.salary
-        current_other = self.current_other
-        current_401k = self.current_401k
-        current_roth = self.current_roth
-        current_hsa = self.current_hsa
-        #current_loans = self.current_loans
-        years[0] = (current_other, current_401k, current_roth, current_hsa)
-
-        for i in range(1, self.years_to_retirement):
-
-            # Based on year i, compute budget recommendations that determine levels of investment, savings, loan payoffs
-            budget = self.BudgetRecommendation(current_salary)
-            rate = (1 + self.annual_blended_return) ** (1 / self.freq) - 1
-            invest_401k = budget[6]
-            invest_roth = budget[7]
-            invest_hsa = budget[8]
-            invest_other = budget[9] * self.savings_rate
-
-            # Compute end of year value as sum of future value of annuity investments and current investments forwarded by one year
-            current_401k = current_401k * (1 + self.annual_blended_return) + Tools.FVA(self, invest_401k, self.freq, rate)
-            current_roth = current_roth * (1 + self.annual_blended_return) + Tools.FVA(self, invest_roth, self.freq, rate)
-            current_hsa = current_hsa * (1 + self.annual_blended_return) + Tools.FVA(self, invest_hsa, self.freq, rate)
-            current_other = current_other * (1 + self.annual_blended_return) + Tools.FVA(self, invest_other, self.freq, rate)
-
-            # Store values in dict and forward salary by one year
-            years[i] = (current_other, current_401k, current_roth, current_hsa)
-            current_salary = current_salary * (1 + self.salary_inc)
-
-        # Return dictionary representing each year's net value (general savings, 401k, ROTH IRA, HSA, loans, etc.)
-        return years
+        return NetWorthResult(total, fv_401k, fv_roth_ira, fv_hsa, fv_other)
+
+    # Forecast value of each vehicle year by year | runs the batched salary path, tax and closed-form balance recurrence of
+    # Batch.Forecast for this one household; future_rules=True taxes each forecast year with that year's tax rules
+    def Forecast(self, future_rules=False):
+
+        # Each year's net value (general savings, 401k, ROTH IRA, HSA), indexable by year like a dictionary
+        balances = Batch.FromBudgets([self]).Forecast(future_rules=future_rules)[0, :max(self.years_to_retirement, 1)]
+        return ForecastResult(balances)
 
     # Estimate monthly income in retirement based on 401k and ROTH IRA based on number of years to live based on TODAY's tax rate
-    def RetirementIncome(self, fv_401k, fv_roth_ira, fv_other, stocks=0.1, bonds=0.9):
+    # social_security is a monthly benefit (see SocialSecurity); up to 85% of it is taxable
+    def RetirementIncome(self, fv_401k, fv_roth_ira, fv_other, stocks=0.1, bonds=0.9, social_security=0):
         
         r = (1 + self.annual_blended_return) ** (1 / 12) - 1
         n = self.years_to_live * 12
@@ -92,16 +503,16 @@ class Budget():
         gross_401k = Tools.AP(self, fv_401k, n, r)
         gross_roth_ira = Tools.AP(self, fv_roth_ira, n, r)
         gross_other = Tools.AP(self, fv_other, n, r)
-        gross_taxable_monthly = gross_401k + gross_other
+        gross_taxable_monthly = gross_401k + gross_other + social_security * 0.85
         gross_taxable_annual = gross_taxable_monthly * 12
 
         f_tax = self.FederalIncomeTax(gross_taxable_annual) * self.freq # Convert back to annual
         s_tax = self.StateIncomeTax(gross_taxable_annual) * self.freq # Convert back to annual
 
-        gross_monthly = gross_401k + gross_roth_ira + gross_other
+        gross_monthly = gross_401k + gross_roth_ira + gross_other + social_security
         monthly_taxes = (f_tax + s_tax) / 12
-        net_monthly = gross_401k + gross_roth_ira + gross_other - (f_tax + s_tax) / 12
-        return gross_monthly, monthly_taxes, net_monthly
+        net_monthly = gross_monthly - (f_tax + s_tax) / 12
+        return RetirementIncomeResult(gross_monthly, monthly_taxes, net_monthly)
 
     # Budget determines the optimal breakdown of your budget
     def BudgetRecommendation(self, salary, hsa=True):
@@ -110,8 +521,7 @@ class Budget():
         retirement = self.Retirement(self.necessity_pct)
         annual_taxable = salary * (1 - (retirement[0] + retirement[2]))
         f_tax = self.FederalIncomeTax(annual_taxable)
-        ss_tax = self.SSMCRTax(annual_taxable)[0]
-        mcr_tax = self.SSMCRTax(annual_taxable)[1]
+        ss_tax, mcr_tax = self.SSMCRTax(annual_taxable)
         s_tax = self.StateIncomeTax(annual_taxable)
 
         net_pay = gross_pay - f_tax - ss_tax - mcr_tax - s_tax
@@ -125,104 +535,99 @@ class Budget():
         max_rent = rent * self.freq / 12
         max_car = salary * 0.35
 
-        return gross_pay, f_tax, ss_tax, mcr_tax, s_tax, rent, r_401k, r_roth_ira, r_hsa, leisure, max_rent, max_car
+        return RecommendationResult(gross_pay, f_tax, ss_tax, mcr_tax, s_tax, rent, r_401k, r_roth_ira, r_hsa, leisure, max_rent, max_car)
 
     # Returns bi-weekly federal income tax
-    def FederalIncomeTax(self, annual_taxable_salary, filing=1):
+    @memoize
+    def FederalIncomeTax(self, annual_taxable_salary, filing=None):
 
-        # Filing (Key) 1 - Single, 2 - Head of Household, 3 - Married Filing Jointly/Qualifying Widow, 4 - Married Filing Separately
-        df = pd.read_excel(r'C:\Users\David Jaeyun Kim\Desktop\Administrative\Coding\Personal Finance\fed_income_tax_2021.xlsx')
-        filing_dict = {1: ('Single_Min','Single_Max'), 2: ('MFJ_Min','MFJ_Max'), 3: ('HOH_Min','HOH_Max')}
-        df = df[['Rate', filing_dict[filing][0], filing_dict[filing][1]]]
+        # Filing (Key) 1 - Single, 2 - Married Filing Jointly/Qualifying Widow, 3 - Head of Household, 4 - Married Filing Separately
+        table = TaxTables.Get(self.tax_year, self.filing if filing is None else filing)
 
+        # Taxes the whole income at the rate of the first bracket whose max it does not exceed (an income on an edge stays below it)
         if annual_taxable_salary < 0 or annual_taxable_salary > 100000000000:
-            print('Error: Enter a valid salary')
-        else:
-            for i in range(df.shape[0]):
-                pct = float(df.iloc[i,0])
-                min = float(df.iloc[i,1])
-                max = float(df.iloc[i,2])
-                if round(annual_taxable_salary, 0) > min and round(annual_taxable_salary, 0) < max:
-                    tax = annual_taxable_salary * pct / self.freq
-                    return tax
+            raise ValueError('Enter a valid salary: %r' % annual_taxable_salary)
+        pct = float(table[np.searchsorted(table[:-1, 2], annual_taxable_salary, side='left'), 0])
+        tax = annual_taxable_salary * pct / self.freq
+        return tax
     
     # Returns Social Security and Medicare tax
-    def SSMCRTax(self, annual_taxable_salary, filing=1):
+    @memoize
+    def SSMCRTax(self, annual_taxable_salary, filing=None):
 
-        # Filing (Key) 1 - Single, 2 - Head of Household, 3 - Married Filing Jointly/Qualifying Widow, 4 - Married Filing Separately
-        if filing == 1:
+        # Filing (Key) 1 - Single, 2 - Married Filing Jointly/Qualifying Widow, 3 - Head of Household, 4 - Married Filing Separately
+        rules = TaxTables.Rules(self.tax_year, 'FICA', self.filing if filing is None else filing)
 
-            # Compute 2021 Social Security Tax
-            ss_tax_rate = 0.062
-            ss_max = 142800
+        # Compute Social Security Tax
+        ss_tax_rate = rules['ss_tax_rate']
+        ss_max = rules['ss_max']
 
-            if annual_taxable_salary > ss_max:
-                ss_tax = ss_max * ss_tax_rate / self.freq
-            else:
-                ss_tax = annual_taxable_salary * ss_tax_rate / self.freq
+        if annual_taxable_salary > ss_max:
+            ss_tax = ss_max * ss_tax_rate / self.freq
+        else:
+            ss_tax = annual_taxable_salary * ss_tax_rate / self.freq
 
-            # Compute 2021 Medicare Tax
-            mcr_tax_rate_1 = 0.0145
-            mcr_tax_rate_2 = 0.0235
-            mcr_breakpoint = 200000
+        # Compute Medicare Tax | the surtax breakpoint depends on filing status
+        mcr_tax_rate_1 = rules['mcr_tax_rate_1']
+        mcr_tax_rate_2 = rules['mcr_tax_rate_2']
+        mcr_breakpoint = rules['mcr_breakpoint']
+
+        if annual_taxable_salary > mcr_breakpoint:
+            mcr_tax = (mcr_breakpoint * mcr_tax_rate_1 + (annual_taxable_salary - mcr_breakpoint) * mcr_tax_rate_2) / self.freq
+        else:
+            mcr_tax = annual_taxable_salary * mcr_tax_rate_1 / self.freq
 
-            if annual_taxable_salary > mcr_breakpoint:
-                mcr_tax = (mcr_breakpoint * mcr_tax_rate_1 + (annual_taxable_salary - mcr_breakpoint) * mcr_tax_rate_2) / self.freq
-            else:
-                mcr_tax = annual_taxable_salary * mcr_tax_rate_1 / self.freq
-            
         return ss_tax, mcr_tax
 
     # Returns bi-weekly state income tax
-    def StateIncomeTax(self, annual_taxable_salary, state = 'CA', filing = 1):
-
-        # Filing (Key) 1 - Single, 2 - Head of Household, 3 - Married Filing Jointly/Qualifying Widow, 4 - Married Filing Separately
-        if filing == 1:
-            tax_single = np.array([[0.010, 0, 8809],
-                                   [0.020, 8810, 20883],
-                                   [0.040, 20884, 32960],
-                                   [0.060, 32961, 45753],
-                                   [0.080, 45754, 57824],
-                                   [0.093, 57825, 295373],
-                                   [0.103, 295374, 354445],
-                                   [0.113, 354446, 590743],
-                                   [0.123, 590742, 1000000],
-                                   [0.133, 1000001, 100000000000]])
-        
+    @memoize
+    def StateIncomeTax(self, annual_taxable_salary, state = None, filing = None):
+
+        # Filing (Key) 1 - Single, 2 - Married Filing Jointly/Qualifying Widow, 3 - Head of Household, 4 - Married Filing Separately
+        table = TaxTables.Get(self.tax_year, self.filing if filing is None else filing, self.state if state is None else state)
+
+        # Same bracket choice as FederalIncomeTax, rounded to cents
         if annual_taxable_salary < 0 or annual_taxable_salary > 100000000000:
-            print('Error: Enter a valid salary')
-        else:
-            for bracket in tax_single:
-                pct = bracket[0]
-                min = bracket[1]
-                max = bracket[2]
-                if round(annual_taxable_salary, 0) > min and round(annual_taxable_salary, 0) < max:
-                    tax = round(annual_taxable_salary * pct / self.freq, 2)
-                    return tax
-
-    # Determines Social Security Benefits (NOT COMPLETE)
-    def SocialSecurity(self, salary):
-        return
+            raise ValueError('Enter a valid salary: %r' % annual_taxable_salary)
+        pct = float(table[np.searchsorted(table[:-1, 2], annual_taxable_salary, side='left'), 0])
+        tax = round(annual_taxable_salary * pct / self.freq, 2)
+        return tax
+
+    # Determines the monthly Social Security benefit for claiming at claiming_age | the amount is in dollars of the retirement year
+    # (what RetirementIncome expects) whatever the claiming age, unless retirement_age is given: then it is grown on to the claiming
+    # year, claiming_age - retirement_age years after retirement (earlier for claiming before retiring)
+    # Earnings are wage-indexed to today with wage_growth (salary_inc by default) and capped at the SS wage base, as SSA does
+    def SocialSecurity(self, salary, claiming_age=67, wage_growth=None, retirement_age=None):
+
+        wage_growth = self.salary_inc if wage_growth is None else wage_growth
 
         # AIME Calculation
-        AIME = Tools.AIME(self, salary, self.salary_inc, self.years_worked, self.years_to_retirement)
+        earnings, k = Tools.Earnings(self, salary, self.salary_inc, self.years_worked, self.years_to_retirement)
+        indexed = np.minimum(earnings / (1 + wage_growth) ** k, TaxTables.Rules(self.tax_year, 'FICA', self.filing)['ss_max'])
+        AIME = Tools.EarningsAIME(self, indexed)
+
+        # PIA Calculation with the tax year's bend points, adjusted for claiming age and grown to retirement-year (or claiming-year) dollars
+        years = self.years_to_retirement if retirement_age is None else self.years_to_retirement + claiming_age - retirement_age
+        benefit = Tools.PIA(self, AIME, self.tax_year, self.filing) * Tools.ClaimingFactor(self, claiming_age) * (1 + wage_growth) ** years
+        return float(benefit[0])
 
-        # PIA Calculation
-        
     # Recommends 401k percentage based on income
+    @memoize
     def Retirement(self, necessity_pct, hsa=True):
 
         # Set up initial assumptions
         gross_pay = round(self.salary / self.freq, 2)
-        f_tax = self.FederalIncomeTax(self.salary) + self.SSMCRTax(self.salary)[0] + self.SSMCRTax(self.salary)[1]
+        ss_tax, mcr_tax = self.SSMCRTax(self.salary)
+        f_tax = self.FederalIncomeTax(self.salary) + ss_tax + mcr_tax
         s_tax = self.StateIncomeTax(self.salary)
-        r_401k_limit = 19500
-        r_roth_ira_limit = 6000
-        r_hsa_limit = 3500
+        limits = TaxTables.Rules(self.tax_year, 'LIMITS', self.filing)
+        r_401k_limit = limits['r_401k_limit']
+        r_roth_ira_limit = limits['r_roth_ira_limit']
+        r_hsa_limit = limits['r_hsa_limit']
         rec_401k = [0.672, 0.765]
         rec_roth_ira = [0.207, 0.235]
         rec_hsa = [0.121, 0.000]
-        roth_ira_earnings_limit = 140000
+        roth_ira_earnings_limit = limits['roth_ira_earnings_limit']
 
         net_pay = gross_pay - f_tax - s_tax
         remaining_pay = net_pay * (1 - necessity_pct)
@@ -270,6 +675,7 @@ class Budget():
                     return (pct_401k, pct_roth_ira, 0)
 
     # Recommends rent as a percentage of gross income
+    @memoize
     def RentMax(self):
 
         # Start with $50k annual salary with a rent max of 30% of gross pay. Assume factor diminishes by 98% for each increase in $10k
@@ -285,103 +691,1246 @@ class Budget():
             rent_pct = baseline_pct * (dim_factor ** marginal)
             return rent_pct
 
+class Batch():
+
+    # Evaluates the Budget model for a whole table of households at once, one NumPy column per Budget attribute
+    # progressive=False reproduces Budget's flat top-bracket taxes, so results match the one-object-per-person loop
+    required = ('salary', 'years_worked', 'years_to_retirement', 'years_to_live', 'necessity_pct')
+    defaults = {'freq': 26, 'health_ins': 0, 'current_loans': 0, 'current_401k': 0, 'current_roth': 0, 'current_hsa': 0, 'current_other': 0,
+                's_return': 0.07, 'b_return': 0.02, 'stocks': 0.9, 'bonds': 0.1, 'inflation': 0.02, 'salary_inc': 0.02, 'savings_rate': 0.50, 'hsa': True,
+                'filing': 1, 'state': 'CA', 'tax_year': 2021}
+    dtypes = {'hsa': bool, 'filing': np.int64, 'state': object, 'tax_year': np.int64}
+
+    forecast_fields = ForecastResult.fields
+    recommendation_fields = RecommendationResult.fields
+    networth_fields = NetWorthResult.fields
+    income_fields = RetirementIncomeResult.fields
+
+    # Same assumptions as Budget.Retirement | contribution limits come from TaxTables per household (see Limits)
+    rec_401k = [0.672, 0.765]
+    rec_roth_ira = [0.207, 0.235]
+    rec_hsa = [0.121, 0.000]
+
+    def __init__(self, data, progressive=False):
+
+        # Accepts a DataFrame, a NumPy structured array or a dict of columns | dicts are read directly, without a DataFrame round trip
+        df = data if isinstance(data, (pd.DataFrame, dict)) else pd.DataFrame(data)
+        missing = [column for column in self.required if column not in df]
+        if missing:
+            raise ValueError('Missing required columns: ' + ', '.join(missing))
+
+        self.progressive = progressive
+        for column in self.required:
+            setattr(self, column, np.asarray(df[column], dtype=np.float64))
+        self.size = len(self.salary)
+        for column, default in self.defaults.items():
+            dtype = self.dtypes.get(column, np.float64)
+            if column in df:
+                setattr(self, column, np.asarray(df[column], dtype=dtype))
+            else:
+                setattr(self, column, np.full(self.size, default, dtype=dtype))
+        self.annual_blended_return = self.s_return * self.stocks + self.b_return * self.bonds
+
+        for year, filing, state in set(zip(self.tax_year.tolist(), self.filing.tolist(), self.state.tolist())):
+            TaxTables.Check(year, filing, state)
+
+    # Builds a Batch from existing Budget objects
+    @classmethod
+    def FromBudgets(cls, budgets, progressive=False):
+        columns = {}
+        for column in cls.required + tuple(cls.defaults):
+            attribute = {'s_return': 'annual_s_return', 'b_return': 'annual_b_return'}.get(column, column)
+            if column != 'hsa':
+                columns[column] = [getattr(budget, attribute) for budget in budgets]
+        return cls(columns, progressive)
+
+    # Reshapes a per-household column so it broadcasts against an array whose first axis is the household
+    def Column(self, values, ndim):
+        return np.reshape(values, (self.size,) + (1,) * (ndim - 1))
+
+    # Per-household tax year and filing status columns shaped to broadcast against an ndim-dimensional income array
+    # tax_year overrides the households' own tax years, e.g. with a (households, years) grid of forecast years
+    def TaxKeys(self, ndim, tax_year=None):
+        year = self.Column(self.tax_year, ndim) if tax_year is None else tax_year
+        return self.Column(self.filing, ndim), year
+
+    # Per-paycheck federal tax, matching Budget.FederalIncomeTax
+    def FederalIncomeTax(self, annual_taxable_salary, tax_year=None):
+        ndim = np.ndim(annual_taxable_salary)
+        filing, year = self.TaxKeys(ndim, tax_year)
+        return TaxEngine.Federal(annual_taxable_salary, filing, year, self.Column(self.freq, ndim), self.progressive)
+
+    # Per-paycheck state tax, matching Budget.StateIncomeTax (rounded to cents)
+    def StateIncomeTax(self, annual_taxable_salary, tax_year=None):
+        ndim = np.ndim(annual_taxable_salary)
+        filing, year = self.TaxKeys(ndim, tax_year)
+        state = self.Column(self.state, ndim)
+        return np.round(TaxEngine.State(annual_taxable_salary, state, filing, year, self.Column(self.freq, ndim), self.progressive), 2)
+
+    # Per-household Social Security and Medicare tax, matching Budget.SSMCRTax
+    def SSMCRTax(self, annual_taxable_salary, tax_year=None):
+        ndim = np.ndim(annual_taxable_salary)
+        filing, year = self.TaxKeys(ndim, tax_year)
+        return TaxEngine.FICA(annual_taxable_salary, filing, year, self.Column(self.freq, ndim))
+
+    # Contribution limits for each household's tax year and filing status, keyed by TaxTables.limit_fields
+    # tax_year optionally overrides the households' own tax years, e.g. with a (households, years) grid of forecast years
+    def Limits(self, tax_year=None):
+
+        def Lookup(rows, year, filing):
+            limits = TaxTables.Rules(year, 'LIMITS', filing)
+            return np.stack([np.full(np.shape(rows), limits[field]) for field in TaxTables.limit_fields])
+
+        year = self.tax_year if tax_year is None else tax_year
+        filing = self.Column(self.filing, np.ndim(year))
+        return dict(zip(TaxTables.limit_fields, TaxEngine.Grouped(Lookup, np.zeros(np.shape(year)), year, filing)))
+
+    # Vectorized Budget.Retirement | every branch becomes a mask and np.select picks the allocation per household
+    # tax_year optionally gives a (households, years) grid of tax years, returning each year's split under that year's rules
+    def Retirement(self, tax_year=None):
+
+        ndim = 1 if tax_year is None else np.ndim(tax_year)
+        salary = self.Column(self.salary, ndim)
+        freq = self.Column(self.freq, ndim)
+        gross_pay = np.round(salary / freq, 2)
+        ss_tax, mcr_tax = self.SSMCRTax(salary, tax_year)
+        f_tax = self.FederalIncomeTax(salary, tax_year) + ss_tax + mcr_tax
+        s_tax = self.StateIncomeTax(salary, tax_year)
+        limits = self.Limits(tax_year)
+        r_401k_limit = limits['r_401k_limit']
+        r_roth_ira_limit = limits['r_roth_ira_limit']
+        r_hsa_limit = limits['r_hsa_limit']
+
+        net_pay = gross_pay - f_tax - s_tax
+        remaining_pay = net_pay * (1 - self.Column(self.necessity_pct, ndim))
+        annual_remaining = remaining_pay * freq
+
+        over_limit = net_pay * freq > limits['roth_ira_earnings_limit']
+        hsa = self.Column(self.hsa, ndim)
+        conditions = [over_limit & hsa & (annual_remaining >= r_401k_limit + r_hsa_limit),
+                      over_limit & hsa,
+                      over_limit & ~hsa & (remaining_pay >= r_401k_limit),
+                      over_limit & ~hsa,
+                      ~over_limit & hsa & (annual_remaining >= r_401k_limit + r_roth_ira_limit + r_hsa_limit),
+                      ~over_limit & hsa,
+                      ~over_limit & ~hsa & (remaining_pay >= r_401k_limit + r_roth_ira_limit)]
+        share = remaining_pay / gross_pay
+
+        pct_401k = np.select(conditions, [r_401k_limit / salary,
+                                          share * self.rec_401k[0],
+                                          r_401k_limit / gross_pay,
+                                          share * self.rec_401k[1],
+                                          r_401k_limit / salary,
+                                          share * self.rec_401k[0],
+                                          r_401k_limit / gross_pay], share * self.rec_401k[1])
+        pct_roth_ira = np.select(conditions, [0, 0, 0, 0,
+                                              r_roth_ira_limit / salary,
+                                              share * self.rec_roth_ira[0],
+                                              r_roth_ira_limit / gross_pay], share * self.rec_roth_ira[1])
+        pct_hsa = np.select(conditions, [r_hsa_limit / salary,
+                                         share * self.rec_hsa[0],
+                                         0, 0,
+                                         r_hsa_limit / salary,
+                                         share * self.rec_hsa[0],
+                                         0], 0)
+        return pct_401k, pct_roth_ira, pct_hsa
+
+    # Vectorized Budget.RentMax
+    def RentMax(self):
+        baseline_index = 5
+        baseline_pct = 0.30
+        dim_factor = 0.98
+        salary_index = self.salary / 10000
+        marginal = salary_index - baseline_index + 1
+        return np.where(salary_index <= baseline_index, baseline_pct, baseline_pct * dim_factor ** marginal)
+
+    # Vectorized Budget.BudgetRecommendation | salary defaults to each household's own salary and may be (households, years)
+    # tax_year optionally gives the tax year of every salary, e.g. to tax each forecast year with its own rules
+    def BudgetRecommendation(self, salary=None, tax_year=None):
+
+        salary = self.salary if salary is None else np.asarray(salary, dtype=np.float64)
+        ndim = salary.ndim
+        freq = self.Column(self.freq, ndim)
+        gross_pay = salary / freq
+        retirement = [self.Column(pct, ndim) for pct in self.Retirement()] if tax_year is None else self.Retirement(tax_year)
+        annual_taxable = salary * (1 - (retirement[0] + retirement[2]))
+        f_tax = self.FederalIncomeTax(annual_taxable, tax_year)
+        ss_tax, mcr_tax = self.SSMCRTax(annual_taxable, tax_year)
+        s_tax = self.StateIncomeTax(annual_taxable, tax_year)
+
+        net_pay = gross_pay - f_tax - ss_tax - mcr_tax - s_tax
+        r_401k = gross_pay * retirement[0]
+        r_roth_ira = gross_pay * retirement[1]
+        r_hsa = gross_pay * retirement[2]
+        rent = gross_pay * self.Column(self.RentMax(), ndim)
+        leisure = net_pay - r_401k - r_roth_ira - r_hsa - rent
+
+        max_rent = rent * freq / 12
+        max_car = salary * 0.35
+
+        return ResultColumns(RecommendationResult, (gross_pay, f_tax, ss_tax, mcr_tax, s_tax, rent, r_401k, r_roth_ira, r_hsa, leisure, max_rent, max_car))
+
+    # Returns each year's (other, 401k, ROTH IRA, HSA) contribution per paycheck as a (households, years - 1, 4) array
+    # future_rules=True taxes forecast year i and caps its contributions with the rules of tax_year + i (the latest rules on file
+    # for years past them)
+    def Contributions(self, future_rules=False):
+
+        # Salary path for forecast years 1..N-1, each year taxed at the salary it starts with
+        years = int(self.years_to_retirement.max())
+        salary_path = self.salary[:, None] * (1 + self.salary_inc[:, None]) ** np.arange(max(years - 1, 0))
+        tax_year = self.tax_year[:, None] + np.arange(max(years - 1, 0)) if future_rules else None
+        budget = self.BudgetRecommendation(salary_path, tax_year)
+        invest_other = budget[9] * self.savings_rate[:, None]
+        return np.stack((invest_other, budget[6], budget[7], budget[8]), axis=-1)
+
+    # Vectorized Budget.Forecast | returns a (households, years, 4) array of (other, 401k, ROTH IRA, HSA) balances, NaN past each horizon
+    def Forecast(self, contributions=None, future_rules=False):
+
+        contributions = self.Contributions(future_rules) if contributions is None else contributions
+        years = contributions.shape[1] + 1
+        growth = 1 + self.annual_blended_return[:, None, None]
+        rate = (1 + self.annual_blended_return) ** (1 / self.freq) - 1
+        annual = Tools.FVA(self, contributions, self.freq[:, None, None], rate[:, None, None])
+
+        # B_i = g * B_(i-1) + c_i unrolls to B_i = g^i * (B_0 + sum_(j<=i) c_j * g^(-j))
+        start = np.stack((self.current_other, self.current_401k, self.current_roth, self.current_hsa), axis=-1)[:, None, :]
+        powers = growth ** np.arange(years)[None, :, None]
+        balances = powers * (start + np.concatenate((np.zeros_like(start), np.cumsum(annual / powers[:, 1:], axis=1)), axis=1))
+
+        balances[np.arange(years)[None, :] >= np.maximum(self.years_to_retirement, 1)[:, None]] = np.nan
+        return balances
+
+    # Vectorized Budget.NetWorth
+    def NetWorth(self, r_401k, r_roth, r_hsa, other):
+
+        r = (1 + self.annual_blended_return) ** (1 / self.freq) - 1
+        n = self.years_to_retirement * self.freq
+
+        fv_401k = np.round(Tools.FVA(self, r_401k, n, r), 2)
+        fv_roth_ira = np.round(Tools.FVA(self, r_roth, n, r), 2)
+        fv_hsa = np.round(Tools.FVA(self, r_hsa, n, r), 2)
+        fv_other = np.round(Tools.FVA(self, other, n, r), 2)
+        total = fv_401k + fv_roth_ira + fv_hsa + fv_other
+        return ResultColumns(NetWorthResult, (total, fv_401k, fv_roth_ira, fv_hsa, fv_other))
+
+    # Vectorized Budget.SocialSecurity | monthly benefit per household in dollars of its retirement year, or of its claiming year
+    # when retirement_age is given
+    def SocialSecurity(self, claiming_age=67, wage_growth=None, retirement_age=None):
+
+        wage_growth = self.salary_inc if wage_growth is None else np.broadcast_to(wage_growth, (self.size,))
+        earnings, k = Tools.Earnings(self, self.salary, self.salary_inc, self.years_worked, self.years_to_retirement)
+        ss_max = TaxEngine.Grouped(lambda rows, year, filing: np.full(np.shape(rows), TaxTables.Rules(year, 'FICA', filing)['ss_max']),
+                                   np.zeros(self.size), self.tax_year, self.filing)
+        indexed = np.minimum(earnings / (1 + wage_growth[:, None]) ** k, ss_max[:, None])
+        pia = TaxEngine.Grouped(lambda aime, year, filing: Tools.PIA(self, aime, year, filing), Tools.EarningsAIME(self, indexed),
+                                self.tax_year, self.filing)
+        years = self.years_to_retirement if retirement_age is None else self.years_to_retirement + np.subtract(claiming_age, retirement_age)
+        return pia * Tools.ClaimingFactor(self, claiming_age) * (1 + wage_growth) ** years
+
+    # Vectorized Budget.RetirementIncome
+    def RetirementIncome(self, fv_401k, fv_roth_ira, fv_other, social_security=0):
+
+        r = (1 + self.annual_blended_return) ** (1 / 12) - 1
+        n = self.years_to_live * 12
+
+        gross_401k = Tools.AP(self, fv_401k, n, r)
+        gross_roth_ira = Tools.AP(self, fv_roth_ira, n, r)
+        gross_other = Tools.AP(self, fv_other, n, r)
+        gross_taxable_annual = (gross_401k + gross_other + social_security * 0.85) * 12
+
+        f_tax = self.FederalIncomeTax(gross_taxable_annual) * self.freq
+        s_tax = self.StateIncomeTax(gross_taxable_annual) * self.freq
+
+        gross_monthly = gross_401k + gross_roth_ira + gross_other + social_security
+        monthly_taxes = (f_tax + s_tax) / 12
+        net_monthly = gross_monthly - monthly_taxes
+        return ResultColumns(RetirementIncomeResult, (gross_monthly, monthly_taxes, net_monthly))
+
+    # Runs BudgetRecommendation, NetWorth and RetirementIncome for every household and returns one column per field
+    # forecast=True adds the balances of each household's final Forecast year as forecast_* columns
+    # claiming_age adds a social_security column and feeds the benefit into RetirementIncome
+    def Run(self, forecast=False, claiming_age=None):
+
+        r = self.BudgetRecommendation()
+        n = self.NetWorth(r[6], r[7], r[8], r[9] * self.savings_rate)
+        social_security = 0 if claiming_age is None else self.SocialSecurity(claiming_age)
+        m = self.RetirementIncome(n[1], n[2], n[4], social_security)
+
+        columns = dict(zip(self.recommendation_fields, r))
+        columns.update(zip(self.networth_fields, n))
+        if claiming_age is not None:
+            columns['social_security'] = social_security
+        columns.update(zip(self.income_fields, m))
+        if forecast:
+            final = self.Forecast()[np.arange(self.size), np.maximum(self.years_to_retirement.astype(int), 1) - 1]
+            columns.update(('forecast_' + field, final[:, i]) for i, field in enumerate(self.forecast_fields))
+        return pd.DataFrame(columns)
+
+class Simulation():
+
+    # Monte Carlo retirement simulator | draws stock and bond return paths for a Budget, rebalancing to its stocks/bonds weights each year
+    # Contributions follow Forecast, and decumulation pays out the Tools.AP income the deterministic Forecast balance supports (excluding HSA)
+    percentiles = (5, 10, 25, 50, 75, 90, 95)
+    methods = ('normal', 'lognormal', 'bootstrap')
+
+    def __init__(self, budget, paths=10000, method='normal', s_vol=0.15, b_vol=0.05, correlation=0.0, history=None, seed=None, chunk_size=10000):
+
+        if method not in self.methods:
+            raise ValueError('method must be one of: ' + ', '.join(self.methods))
+        if method == 'bootstrap' and history is None:
+            raise ValueError('bootstrap needs a history of annual (stocks, bonds) returns')
+
+        self.budget = budget
+        self.paths = paths
+        self.method = method
+        self.s_vol = s_vol
+        self.b_vol = b_vol
+        self.correlation = correlation
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+        # History is a (years, 2) array or a DataFrame with 'stocks' and 'bonds' columns of annual returns
+        if isinstance(history, pd.DataFrame):
+            history = history[['stocks', 'bonds']]
+        self.history = None if history is None else np.asarray(history, dtype=np.float64)
+
+        # Per-paycheck contributions for each accumulation year and the deterministic plan they imply
+        batch = Batch.FromBudgets([budget])
+        contributions = batch.Contributions()[0]
+        self.contributions = contributions[:, 0] + contributions[:, 1] + contributions[:, 2]
+        plan = batch.Forecast(batch.Contributions())[0, budget.years_to_retirement - 1]
+        r = (1 + budget.annual_blended_return) ** (1 / 12) - 1
+        self.monthly_income = Tools.AP(self, plan[0] + plan[1] + plan[2], budget.years_to_live * 12, r)
+
+    # Draws annual (stocks, bonds) returns and returns the rebalanced portfolio return, shape (size, years)
+    def Returns(self, rng, size, years):
+
+        b = self.budget
+        if self.method == 'bootstrap':
+            draws = self.history[rng.integers(0, self.history.shape[0], (size, years))]
+            s_r, b_r = draws[..., 0], draws[..., 1]
+        else:
+            z_s = rng.standard_normal((size, years))
+            z_b = self.correlation * z_s + np.sqrt(1 - self.correlation ** 2) * rng.standard_normal((size, years))
+            if self.method == 'normal':
+                s_r = b.annual_s_return + self.s_vol * z_s
+                b_r = b.annual_b_return + self.b_vol * z_b
+            else:
+                # Log returns chosen so the arithmetic mean and volatility match s_return/s_vol and b_return/b_vol
+                s_sigma = np.sqrt(np.log(1 + self.s_vol ** 2 / (1 + b.annual_s_return) ** 2))
+                b_sigma = np.sqrt(np.log(1 + self.b_vol ** 2 / (1 + b.annual_b_return) ** 2))
+                s_r = np.exp(np.log(1 + b.annual_s_return) - s_sigma ** 2 / 2 + s_sigma * z_s) - 1
+                b_r = np.exp(np.log(1 + b.annual_b_return) - b_sigma ** 2 / 2 + b_sigma * z_b) - 1
+
+        # A year can lose at most 99% of the portfolio
+        return np.maximum(b.stocks * s_r + b.bonds * b_r, -0.99)
+
+    # Simulates one chunk of paths | returns total balances (size, years) for every year of the timeline and which paths ran out
+    def Chunk(self, rng, size):
+
+        b = self.budget
+        accumulation = self.contributions.shape[0]
+        returns = self.Returns(rng, size, accumulation + b.years_to_live)
+
+        # Accumulate | B_i = G_i * (B_0 + cumsum(a_j / G_j)) where G is the cumulative growth along the path
+        growth = 1 + returns[:, :accumulation]
+        annual = Tools.FVA(self, self.contributions, b.freq, growth ** (1 / b.freq) - 1)
+        cumulative = np.cumprod(growth, axis=1)
+        start = b.current_other + b.current_401k + b.current_roth
+        saved = cumulative * (start + np.cumsum(annual / cumulative, axis=1))
+        retirement = saved[:, -1] if accumulation else np.full(size, float(start))
+
+        # Decumulate the planned monthly income with the same recurrence, withdrawing at the end of each month
+        growth = 1 + returns[:, accumulation:]
+        withdrawn = Tools.FVA(self, self.monthly_income, 12, growth ** (1 / 12) - 1)
+        cumulative = np.cumprod(growth, axis=1)
+        spent = cumulative * (retirement[:, None] - np.cumsum(withdrawn / cumulative, axis=1))
+
+        depleted = np.cumsum(spent < 0, axis=1) > 0
+        spent[depleted] = 0
+        balances = np.concatenate((np.full((size, 1), float(start)), saved, spent), axis=1)
+        return balances, depleted[:, -1] if b.years_to_live else np.zeros(size, dtype=bool)
+
+    # Runs every path in chunks of chunk_size and reports percentile balances and the probability of ruin
+    def Run(self):
+
+        b = self.budget
+        years = self.contributions.shape[0] + 1 + b.years_to_live
+        balances = np.empty((self.paths, years), dtype=np.float32)
+        ruined = np.empty(self.paths, dtype=bool)
+
+        # Each chunk gets its own child stream so a given seed and chunk_size always reproduce the same paths
+        chunks = range(0, self.paths, self.chunk_size)
+        streams = np.random.SeedSequence(self.seed).spawn(len(chunks))
+        for start, stream in zip(chunks, streams):
+            stop = min(start + self.chunk_size, self.paths)
+            balances[start:stop], ruined[start:stop] = self.Chunk(np.random.default_rng(stream), stop - start)
+
+        retirement_year = self.contributions.shape[0]
+        bands = np.percentile(balances, self.percentiles, axis=0).T
+        return {'monthly_income': self.monthly_income,
+                'probability_of_ruin': float(ruined.mean()),
+                'retirement': pd.Series(bands[retirement_year], index=self.percentiles),
+                'final': pd.Series(bands[-1], index=self.percentiles),
+                'percentiles': pd.DataFrame(bands, columns=self.percentiles)}
+
+class Sweep():
+
+    # Runs the Budget model over the Cartesian grid of parameter ranges, e.g. Sweep(b, {'necessity_pct': [0.5, 0.6], 's_return': [0.05, 0.07]})
+    # Grid points are evaluated as Batch chunks across worker processes and returned in grid order as one tidy DataFrame
+    def __init__(self, budget, grid, workers=None, chunk_size=1000):
+
+        unknown = [param for param in grid if param not in Batch.required + tuple(Batch.defaults)]
+        if unknown:
+            raise ValueError('Unknown sweep parameters: ' + ', '.join(unknown))
+
+        self.budget = budget
+        self.grid = grid
+        self.workers = workers
+        self.chunk_size = chunk_size
+
+    # Returns one row of Batch inputs per grid point, the base Budget supplying every parameter that is not swept
+    def Grid(self):
+
+        params = list(self.grid)
+        points = pd.DataFrame(list(itertools.product(*self.grid.values())), columns=params)
+        base = Batch.FromBudgets([self.budget])
+        for column in Batch.required + tuple(Batch.defaults):
+            if column not in params and column != 'hsa':
+                points[column] = getattr(base, column)[0]
+        return points
+
+    # Evaluates one chunk of grid points | NetWorth, RetirementIncome, their inflation-adjusted values and the final Forecast year
+    @staticmethod
+    def Evaluate(points):
+
+        batch = Batch(points)
+        results = batch.Run(forecast=True)
+        deflator = (1 + batch.inflation) ** (-batch.years_to_retirement)
+        results.insert(results.columns.get_loc('net_monthly') + 1, 'total_real', results['total'] * deflator)
+        results.insert(results.columns.get_loc('total_real') + 1, 'net_monthly_real', results['net_monthly'] * deflator)
+        return results
+
+    # Runs every chunk, in-process when workers == 1, and concatenates the results in grid order
+    def Run(self):
+
+        points = self.Grid()
+        chunks = [points.iloc[i:i + self.chunk_size].reset_index(drop=True) for i in range(0, len(points), self.chunk_size)]
+
+        if self.workers == 1:
+            results = [self.Evaluate(chunk) for chunk in chunks]
+        else:
+            # The tax rules index is built once here and handed to each worker when it starts
+            if not TaxTables.built:
+                TaxTables.Build()
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=TaxTables.Share, initargs=(TaxTables.tables,)) as executor:
+                results = Profiler.Map(executor, self.Evaluate, chunks)
+
+        results = pd.concat(results, ignore_index=True)
+        return pd.concat([points[list(self.grid)], results], axis=1)
+
+class Solver():
+
+    # Goal seek | inverts the Budget model for one input so that a target output (net monthly retirement income or terminal balance) is hit
+    # NetWorth and RetirementIncome are monotonic in each input, but they jump where contributions reach their limits and, with
+    # progressive=False, where the flat top-bracket tax changes rate, so a target can fall inside a jump and never be hit within tol
+    # Such clients stop once the bracket is narrower than xtol and get the bracket end that meets the target
+    bounds = {'savings_rate': (0.0, 1.0), 'necessity_pct': (0.0, 1.0), 'years_to_retirement': (1.0, 60.0), 'stocks': (0.0, 1.0)}
+    targets = {'net_monthly': 'net_monthly', 'balance': 'total'}
+
+    def __init__(self, parameter, target='net_monthly', tol=0.01, xtol=1e-9, max_iter=60, progressive=False):
+
+        if parameter not in self.bounds:
+            raise ValueError('parameter must be one of: ' + ', '.join(self.bounds))
+        if target not in self.targets:
+            raise ValueError('target must be one of: ' + ', '.join(self.targets))
+
+        self.parameter = parameter
+        self.target = target
+        self.tol = tol
+        self.xtol = xtol
+        self.max_iter = max_iter
+        self.progressive = progressive
+        self.evaluations = 0
+        self.converged = None
+
+    # Runs the model with the solved-for input set to x for every client
+    def Evaluate(self, batch, x):
+
+        setattr(batch, self.parameter, x)
+        if self.parameter == 'stocks':
+            batch.bonds = 1 - x
+        batch.annual_blended_return = batch.s_return * batch.stocks + batch.b_return * batch.bonds
+        self.evaluations += 1
+        return batch.Run()[self.targets[self.target]].to_numpy()
+
+    # Solves every client at once with the Illinois variant of regula falsi | returns NaN where the target is outside the bounds
+    # or neither within tol nor narrowed to xtol after max_iter steps, and leaves the per-client mask in self.converged
+    # A Batch passed in is not modified: the trial inputs are set on a shallow copy that rebinds the solved-for columns
+    def SolveBatch(self, data, values, lo=None, hi=None):
+
+        batch = copy.copy(data) if isinstance(data, Batch) else Batch(data, self.progressive)
+        values = np.broadcast_to(np.asarray(values, dtype=np.float64), (batch.size,))
+        lo = np.full(batch.size, self.bounds[self.parameter][0] if lo is None else lo, dtype=np.float64)
+        hi = np.full(batch.size, self.bounds[self.parameter][1] if hi is None else hi, dtype=np.float64)
+        self.evaluations = 0
+
+        f_lo = self.Evaluate(batch, lo) - values
+        f_hi = self.Evaluate(batch, hi) - values
+        bracketed = np.sign(f_lo) != np.sign(f_hi)
+        x = np.where(np.abs(f_lo) <= self.tol, lo, hi)
+        converged = (np.abs(f_lo) <= self.tol) | (np.abs(f_hi) <= self.tol)
+        done = ~bracketed | converged
+        bisect = np.zeros(batch.size, dtype=bool)
+
+        for _ in range(self.max_iter):
+            if done.all():
+                break
+
+            # Secant step inside the bracket, falling back to bisection when the bracket values coincide or the last step did not
+            # halve the bracket (a jump in the target slows regula falsi to a crawl)
+            denominator = f_hi - f_lo
+            secant = ~bisect & (denominator != 0)
+            step = np.where(secant, f_hi * (hi - lo) / np.where(secant, denominator, 1), (hi - lo) / 2)
+            width = np.abs(hi - lo)
+            x = np.where(done, x, hi - step)
+            f_x = self.Evaluate(batch, x) - values
+
+            # Keep the root bracketed; halving the stale end's value stops regula falsi from stalling on one side
+            crossed = np.sign(f_x) != np.sign(f_hi)
+            lo, f_lo = np.where(done, lo, np.where(crossed, hi, lo)), np.where(done, f_lo, np.where(crossed, f_hi, f_lo / 2))
+            hi, f_hi = np.where(done, hi, x), np.where(done, f_hi, f_x)
+            bisect = np.abs(hi - lo) > width / 2
+            converged = converged | (~done & (np.abs(f_x) <= self.tol))
+
+            # A bracket narrower than xtol straddles a jump in the target | take the end at or above it
+            narrow = ~done & ~converged & (np.abs(hi - lo) < self.xtol)
+            x = np.where(narrow, np.where(f_hi >= 0, hi, lo), x)
+            converged = converged | narrow
+            done = done | converged
+
+        self.converged = converged
+        x = np.where(converged, x, np.nan)
+        if self.parameter == 'years_to_retirement':
+            x = np.ceil(x)
+        return x
+
+    # Solves a single Budget
+    def Solve(self, budget, value, lo=None, hi=None):
+        return float(self.SolveBatch(Batch.FromBudgets([budget], self.progressive), value, lo, hi)[0])
+
+class IncrementalForecast():
+
+    # Forecast that keeps its per-year intermediate state and, when one input changes, recomputes only the stages downstream of it
+    # Stages run in order: salary path -> budget (Retirement split and taxes per year) -> contributions -> annual FVA -> balances
+    stages = ('salary', 'budget', 'contributions', 'annual', 'balances')
+    depends = {'salary': 'salary', 'salary_inc': 'salary', 'years_to_retirement': 'salary',
+               'necessity_pct': 'budget', 'freq': 'budget', 'hsa': 'budget', 'filing': 'budget', 'state': 'budget', 'tax_year': 'budget',
+               'savings_rate': 'contributions',
+               's_return': 'annual', 'b_return': 'annual', 'stocks': 'annual', 'bonds': 'annual',
+               'current_other': 'balances', 'current_401k': 'balances', 'current_roth': 'balances', 'current_hsa': 'balances',
+               'inflation': None}
+
+    def __init__(self, budget):
+        self.batch = Batch.FromBudgets([budget])
+        self.adjustments = {}
+        self.stale = 0
+        self.stale_year = 0
+        self.recomputed = []
+
+    # Changes one or more inputs, e.g. Set(savings_rate=0.4), and marks the earliest affected stage stale
+    # Every value is converted and the tax keys are checked before anything changes, so a rejected Set leaves the forecast as it was
+    def Set(self, **params):
+        for name in params:
+            if name not in self.depends:
+                raise ValueError('Unknown forecast input: ' + name)
+        values = {name: np.array([value], dtype=Batch.dtypes.get(name, np.float64)) for name, value in params.items()}
+        keys = {name: values[name][0] if name in values else getattr(self.batch, name)[0] for name in ('tax_year', 'filing', 'state')}
+        TaxTables.Check(int(keys['tax_year']), int(keys['filing']), keys['state'])
+
+        for name, value in values.items():
+            setattr(self.batch, name, value)
+            stage = self.depends[name]
+            if stage is not None:
+                self.Invalidate(self.stages.index(stage), 0)
+        b = self.batch
+        b.annual_blended_return = b.s_return * b.stocks + b.b_return * b.bonds
+
+    # Adds a one-time amount to a vehicle ('other', 'r_401k', 'r_roth_ira' or 'r_hsa') at the end of year, recomputing years >= year only
+    def Adjust(self, year, vehicle, amount):
+        key = (year, Batch.forecast_fields.index(vehicle))
+        self.adjustments[key] = self.adjustments.get(key, 0) + amount
+        self.Invalidate(self.stages.index('balances'), year)
+
+    # Marks stage stale from year on | an up-to-date forecast takes (stage, year) as is, so a balances edit in year k only rolls
+    # years k and later; otherwise the earliest stale stage (and year) wins
+    def Invalidate(self, stage, year):
+        if self.stale == len(self.stages):
+            self.stale, self.stale_year = stage, year
+        elif stage < self.stale:
+            self.stale, self.stale_year = stage, 0
+        elif stage == self.stale == len(self.stages) - 1:
+            self.stale_year = min(self.stale_year, year)
+
+    # Brings every stale stage up to date; recomputed lists the stages that ran
+    def Update(self):
+
+        b = self.batch
+        self.recomputed = list(self.stages[self.stale:])
+        stage = self.stale
+        if stage <= 0:
+            years = int(b.years_to_retirement[0])
+            self.years = max(years, 1)
+            self.salary_path = b.salary[:, None] * (1 + b.salary_inc[:, None]) ** np.arange(max(years - 1, 0))
+        if stage <= 1:
+            self.budget = b.BudgetRecommendation(self.salary_path)
+        if stage <= 2:
+            r = self.budget
+            self.contributions = np.stack((r[9] * b.savings_rate[:, None], r[6], r[7], r[8]), axis=-1)[0]
+        if stage <= 3:
+            rate = (1 + b.annual_blended_return[0]) ** (1 / b.freq[0]) - 1
+            self.growth = 1 + b.annual_blended_return[0]
+            self.annual = Tools.FVA(self, self.contributions, b.freq[0], rate)
+        if stage <= 4:
+            self.Roll(0 if stage < 4 else self.stale_year)
+        self.stale, self.stale_year = len(self.stages), 0
+
+    # Rolls balances forward from year k with B_i = g * B_(i-1) + a_i + adjustments_i, keeping years before k as they are
+    def Roll(self, k):
+
+        b = self.batch
+        flows = np.zeros((self.years, 4))
+        flows[1:] = self.annual
+        for (year, vehicle), amount in self.adjustments.items():
+            if year < self.years:
+                flows[year, vehicle] += amount
+
+        if k == 0 or not hasattr(self, 'balances') or self.balances.shape[0] != self.years:
+            self.balances = np.empty((self.years, 4))
+            self.balances[0] = [b.current_other[0], b.current_401k[0], b.current_roth[0], b.current_hsa[0]]
+            self.balances[0] += flows[0]
+            k = 1
+        if k < self.years:
+            powers = self.growth ** np.arange(1, self.years - k + 1)[:, None]
+            self.balances[k:] = powers * (self.balances[k - 1] + np.cumsum(flows[k:] / powers, axis=0))
+
+    # Returns the (years, vehicles) forecast, recomputing only what changed since the last call
+    def Balances(self):
+        self.recomputed = []
+        if self.stale < len(self.stages):
+            self.Update()
+        return pd.DataFrame(self.balances, columns=Batch.forecast_fields)
+
+    # Returns the forecast in today's dollars; changing inflation never touches the stages above
+    def RealBalances(self):
+        return Tools.RealValues(self, self.Balances(), self.batch.inflation[0])
+
+class Drawdown():
+
+    # Year-by-year retirement drawdown for many retirees and return paths at once
+    # Each year: take RMDs, withdraw from the pots in order until after-tax cash covers spending, tax the year's income with the
+    # bracket tables, apply guardrails to next year's spending, then grow what is left
+    vehicles = ('other', 'r_401k', 'r_roth_ira', 'r_hsa')
+    fields = ('spending', 'social_security', 'rmd', 'withdrawal_other', 'withdrawal_r_401k', 'withdrawal_r_roth_ira', 'withdrawal_r_hsa',
+              'tax', 'shortfall', 'balance_other', 'balance_r_401k', 'balance_r_roth_ira', 'balance_r_hsa')
+
+    # IRS Uniform Lifetime Table divisors by age (120 and older use 2.0)
+    rmd_divisors = np.array([27.4, 26.5, 25.5, 24.6, 23.7, 22.9, 22.0, 21.1, 20.2, 19.4, 18.5, 17.7, 16.8, 16.0, 15.2, 14.4, 13.7, 12.9,
+                             12.2, 11.5, 10.8, 10.1, 9.5, 8.9, 8.4, 7.8, 7.3, 6.8, 6.4, 6.0, 5.6, 5.2, 4.9, 4.6, 4.3, 4.1, 3.9, 3.7,
+                             3.5, 3.4, 3.3, 3.1, 3.0, 2.9, 2.8, 2.7, 2.5, 2.3, 2.0])
+    rmd_first_table_age = 72
+
+    # guardrails = (upper, lower, adjustment), e.g. (0.2, 0.2, 0.1): cut spending 10% when the withdrawal rate rises 20% above
+    # its starting level, raise it 10% when it falls 20% below
+    def __init__(self, order=('other', 'r_401k', 'r_roth_ira', 'r_hsa'), taxable=('other', 'r_401k'), rmd_age=73, guardrails=None,
+                 inflation=0.02, state='CA', filing=1, tax_year=2021, iterations=12):
+
+        unknown = [vehicle for vehicle in tuple(order) + tuple(taxable) if vehicle not in self.vehicles]
+        if unknown:
+            raise ValueError('Unknown vehicles: ' + ', '.join(unknown))
+
+        self.order = [self.vehicles.index(vehicle) for vehicle in order]
+        self.taxable = np.array([vehicle in taxable for vehicle in self.vehicles])
+        self.rmd_age = rmd_age
+        self.guardrails = guardrails
+        self.inflation = inflation
+        self.state = state
+        self.filing = filing
+        self.tax_year = tax_year
+        self.iterations = iterations
+        TaxTables.Check(tax_year, filing, state)
+
+    # Annual federal plus state tax on taxable income with the tax_year bracket edges indexed by index = (1 + inflation) ** year
+    # Scaling every edge by index scales the tax by index too, so tax(income) = index * tax(income / index) on the base tables
+    def Tax(self, taxable_income, index=1):
+        deflated = taxable_income / index
+        return index * (TaxEngine.Federal(deflated, self.filing, self.tax_year) +
+                        TaxEngine.State(deflated, self.state, self.filing, self.tax_year))
+
+    # Splits an amount across the pots in withdrawal order, never taking more than a pot holds
+    def Allocate(self, amount, balances):
+        taken = np.zeros_like(balances)
+        remaining = amount
+        for vehicle in self.order:
+            take = np.minimum(remaining, balances[..., vehicle])
+            taken[..., vehicle] = take
+            remaining = remaining - take
+        return taken
+
+    # balances (retirees, 4) starting pots; spending (retirees,) first-year after-tax spending; returns a scalar, (retirees,),
+    # (paths, years) or (retirees, paths, years) of annual returns; social_security is a first-year monthly benefit that gets a
+    # cost-of-living adjustment of inflation every year
+    # Returns a (retirees, paths, years, fields) cash flow array
+    def Run(self, balances, spending, returns, years, start_age=65, social_security=0):
+
+        balances = np.asarray(balances, dtype=np.float64).reshape(-1, 4)
+        retirees = balances.shape[0]
+        returns = np.asarray(returns, dtype=np.float64)
+        returns = {0: lambda: returns.reshape(1, 1, 1), 1: lambda: returns[:, None, None], 2: lambda: returns[None], 3: lambda: returns}[returns.ndim]()
+        returns = np.broadcast_to(returns, (retirees,) + returns.shape[1:])
+        paths = returns.shape[1]
+
+        pots = np.broadcast_to(balances[:, None, :], (retirees, paths, 4)).copy()
+        spend = np.broadcast_to(np.asarray(spending, dtype=np.float64).reshape(-1, 1), (retirees, paths)).copy()
+        benefit = np.broadcast_to(np.asarray(social_security, dtype=np.float64).reshape(-1, 1), (retirees, paths)) * 12
+        age = np.broadcast_to(np.asarray(start_age, dtype=np.float64).reshape(-1, 1), (retirees, paths))
+        initial_rate = spend / np.maximum(pots.sum(axis=-1), 1e-9)
+        flows = np.zeros((retirees, paths, years, len(self.fields)))
+
+        for year in range(years):
+
+            index = (1 + self.inflation) ** year
+
+            # Required minimum distributions come out of the 401k first and count as taxable income
+            divisor = self.rmd_divisors[np.clip(age + year - self.rmd_first_table_age, 0, len(self.rmd_divisors) - 1).astype(int)]
+            rmd = np.where(age + year >= self.rmd_age, pots[..., 1] / divisor, 0)
+            pots[..., 1] -= rmd
+            base_income = rmd + benefit * 0.85
+
+            # Gross up the withdrawal until after-tax cash covers spending | cash is piecewise linear in the withdrawal, so secant
+            # steps from a first fixed-point guess land on the answer in a few re-taxing passes
+            def Cash(needed):
+                taken = self.Allocate(needed, pots)
+                tax = self.Tax(base_income + (taken * self.taxable).sum(axis=-1), index)
+                return taken, tax, rmd + benefit + taken.sum(axis=-1) - tax - spend
+
+            previous = np.maximum(spend + self.Tax(base_income, index) - rmd - benefit, 0)
+            taken, tax, gap_previous = Cash(previous)
+            needed = np.maximum(previous - gap_previous, 0)
+            for _ in range(self.iterations):
+                taken, tax, gap = Cash(needed)
+                moved = needed - previous
+                if np.abs(moved).max() < 0.005:
+                    break
+                slope = (gap - gap_previous) / np.where(moved != 0, moved, 1)
+                step = np.where(slope > 1e-6, gap / np.where(slope > 1e-6, slope, 1), 0)
+                previous, gap_previous = needed, gap
+                needed = np.maximum(needed - step, 0)
+            pots -= taken
+
+            # Cash beyond spending (large RMDs) is reinvested in the other pot; cash short of it is a shortfall
+            cash = rmd + benefit + taken.sum(axis=-1) - tax
+            pots[..., 0] += np.maximum(cash - spend, 0)
+            shortfall = np.where(spend - cash > 0.01, spend - cash, 0)
+
+            flows[:, :, year, 0] = spend
+            flows[:, :, year, 1] = benefit
+            flows[:, :, year, 2] = rmd
+            flows[:, :, year, 3:7] = taken
+            flows[:, :, year, 7] = tax
+            flows[:, :, year, 8] = shortfall
+
+            pots *= 1 + returns[:, :, min(year, returns.shape[2] - 1), None]
+            flows[:, :, year, 9:13] = pots
+
+            # Next year's spending and benefit keep up with inflation, then guardrails trim or raise spending against the starting
+            # withdrawal rate
+            spend = spend * (1 + self.inflation)
+            benefit = benefit * (1 + self.inflation)
+            if self.guardrails is not None:
+                upper, lower, adjustment = self.guardrails
+                rate = spend / np.maximum(pots.sum(axis=-1), 1e-9)
+                spend = np.where(rate > initial_rate * (1 + upper), spend * (1 - adjustment),
+                                 np.where(rate < initial_rate * (1 - lower), spend * (1 + adjustment), spend))
+
+        return flows
+
 class Tools():
 
-    # Calculates future value based on biweekly payments | FV = C * ((1 + i) ** n - 1) / i
+    # Calculates future value based on biweekly payments | FV = C * ((1 + i) ** n - 1) / i, or C * n when i = 0
+    # C, n and r may be scalars or broadcastable arrays
     def FVA(self, C, n, r):
-        fv = C * ((1 + r) ** n - 1) / r
+        if np.ndim(r) == 0:
+            return C * n if r == 0 else C * ((1 + r) ** n - 1) / r
+        zero = r == 0
+        fv = C * np.where(zero, n, ((1 + r) ** n - 1) / np.where(zero, 1, r))
         return fv
 
-    # Calculates present value based on biweekly payments | PV = C * (1 - (1 + i) ** (-n)) / i
+    # Calculates present value based on biweekly payments | PV = C * (1 - (1 + i) ** (-n)) / i, or C * n when i = 0
     def PVA(self, C, n, r):
         #pv = self.FV(C, n, r) / (1 + r) ** n
-        pv = C * (1 - (1 + r) ** (-n)) / r
+        if np.ndim(r) == 0:
+            return C * n if r == 0 else C * (1 - (1 + r) ** (-n)) / r
+        zero = r == 0
+        pv = C * np.where(zero, n, (1 - (1 + r) ** (-n)) / np.where(zero, 1, r))
         return pv
 
-    # Calculates annuity payout, given principle amount | d = C * (r) / (1 - (1 + r) ** (-n))
+    # Calculates annuity payout, given principle amount | d = C * (r) / (1 - (1 + r) ** (-n)), or C / n when r = 0
     def AP(self, C, n, r):
-        d = C * r / (1 - (1 + r) ** (-n))
+        if np.ndim(r) == 0:
+            return C / n if r == 0 else C * r / (1 - (1 + r) ** (-n))
+        zero = r == 0
+        d = C * np.where(zero, 1 / n, r / np.where(zero, 1, 1 - (1 + r) ** (-n)))
         return d
 
     # Calculates estimate of past and future salary based on number of years worked and number of years to retirement
-    def AIME(self, salary, salary_inc, years_worked, years_to_retirement):
+    # Returns a (households, years) earnings matrix (0 where a household has no earnings) and each column's offset k from today
+    def Earnings(self, salary, salary_inc, years_worked, years_to_retirement):
         # Assume salary increases apply in both directions
 
-        age_salary = {}
-        total_years = years_worked + years_to_retirement
+        salary, salary_inc, years_worked, years_to_retirement = (np.atleast_1d(np.asarray(x, dtype=np.float64))
+                                                                 for x in np.broadcast_arrays(salary, salary_inc, years_worked, years_to_retirement))
 
-        # Estimate salary for years prior
-        for i in range(years_worked):
-            index = years_worked - i
-            age_salary[index] = salary * (1 + salary_inc) ** (-i)
-        
-        # Estimate salary for years forward
-        for i in range(years_to_retirement):
-            index = years_worked + i
-            age_salary[index] = salary * (1 + salary_inc) ** i
-
-        # Sum the top 35 years of earnings and divide through by total number of months worked
-        if total_years > 35:
-            salary_sum = dict(sorted(age_salary.items(), key=itemgetter(1), reverse=True)[:35])
-            AIME = sum(salary_sum.values()) / (35 * 12)
-        else:
-            salary_sum = dict(sorted(age_salary.items(), key=itemgetter(1), reverse=True)[:total_years])
-            AIME = sum(salary_sum.values()) / (total_years * 12)
+        # Past years run back to k = 1 - years_worked, future years up to k = years_to_retirement - 1; both share today (k = 0)
+        first = 1 - np.maximum(years_worked, 1)
+        last = np.maximum(years_to_retirement, 1) - 1
+        k = np.arange(int(first.min()), int(last.max()) + 1, dtype=np.float64)
+        worked = (k >= first[:, None]) & (k <= last[:, None]) & (years_worked + years_to_retirement > 0)[:, None]
+        earnings = np.where(worked, salary[:, None] * (1 + salary_inc[:, None]) ** k, 0)
+        return earnings, k
+
+    # Averages the top `years` earnings of each history over years * 12 months | np.partition selects them without sorting whole rows
+    def EarningsAIME(self, earnings, years=35):
+
+        earnings = np.atleast_2d(np.asarray(earnings, dtype=np.float64))
+        years = np.broadcast_to(np.asarray(years, dtype=np.int64), earnings.shape[:1])
+        top = min(int(years.max()), earnings.shape[1])
+        best = earnings if top >= earnings.shape[1] else -np.partition(-earnings, top - 1, axis=1)[:, :top]
+
+        # Sort only the selected columns so households with fewer counted years can read their own partial sum
+        totals = np.cumsum(-np.sort(-best, axis=1), axis=1)
+        totals = np.concatenate((np.zeros((totals.shape[0], 1)), totals), axis=1)
+        sums = totals[np.arange(totals.shape[0]), np.minimum(years, best.shape[1])]
+        return np.where(years > 0, sums / (np.maximum(years, 1) * 12), 0)
+
+    # Calculates Average Indexed Monthly Earnings from the top 35 years (or all years if fewer)
+    def AIME(self, salary, salary_inc, years_worked, years_to_retirement):
+        earnings, _ = Tools.Earnings(self, salary, salary_inc, years_worked, years_to_retirement)
+        total_years = np.minimum(np.asarray(years_worked) + np.asarray(years_to_retirement), 35)
+        AIME = Tools.EarningsAIME(self, earnings, total_years)
+        if np.ndim(salary) == 0 and np.ndim(years_worked) == 0 and np.ndim(years_to_retirement) == 0:
+            return float(AIME[0])
         return AIME
 
-    # Converts all float items in a list to dollars
-    def Convert(self, list):
-        locale.setlocale(locale.LC_ALL, 'English_United States.1252')
-        final = []
-        for item in list:
-            convert = locale.currency(item, grouping = True)
-            final.append(convert)
+    # Calculates the Primary Insurance Amount from AIME (90% / 32% / 15%) with the bend points of a tax year and filing status
+    def PIA(self, aime, year=2021, filing=1):
+        return TaxEngine.Brackets(TaxTables.Rules(year, 'PIA', filing), aime)
+
+    # Calculates the benefit multiplier for claiming at claiming_age | 5/9% per month for the first 36 months early, 5/12% beyond,
+    # and 8% per year of delay up to age 70
+    def ClaimingFactor(self, claiming_age, full_retirement_age=67):
+        months = (np.minimum(np.asarray(claiming_age, dtype=np.float64), 70) - full_retirement_age) * 12
+        early = -months
+        reduction = np.minimum(early, 36) * 5 / 900 + np.maximum(early - 36, 0) * 5 / 1200
+        return np.where(months < 0, 1 - reduction, 1 + months * 8 / 1200)
+
+    # Converts all float items in a list, NumPy array or Series to dollars, e.g. -1234.5 -> '-$1,234.50'
+    # No locale is involved, so it works on any platform and is safe to call from many threads
+    def Convert(self, list, grouping=True, precision=2):
+        values = np.asarray(list, dtype=np.float64)
+        final = Tools.Dollars(self, values.ravel(), grouping, precision)
+
+        if isinstance(list, pd.Series):
+            return pd.Series(final, index=list.index, name=list.name)
+        if isinstance(list, np.ndarray):
+            return final.reshape(values.shape)
+        return final.tolist()
+
+    # Formats a 1-D float array as dollar strings by writing characters straight into a byte matrix
+    def Dollars(self, values, grouping=True, precision=2):
+        if not values.size:
+            return np.array([], dtype=str)
+
+        # Values whose cents do not fit exactly in a float (or are not finite) go through str.format instead
+        simple = np.isfinite(values) & (np.abs(values) * 10 ** precision < 1e11)
+        # Rounds the magnitude to cents exactly as the '%.2f' behind the locale.currency path it replaces does, e.g. 0.005 -> $0.01:
+        # floor(x * 100 + 0.5), except that a product landing exactly on a half cent is decided by its rounding error (recovered
+        # with a Veltkamp split), and true ties go to even
+        magnitude = np.abs(np.where(simple, values, 0))
+        product = magnitude * 10 ** precision
+        high = magnitude * 134217729.0 - (magnitude * 134217729.0 - magnitude)
+        error = (high * 10 ** precision - product) + (magnitude - high) * 10 ** precision
+        scaled = np.floor(product + 0.5)
+        half = scaled - product == 0.5
+        scaled = np.where(half & ((error < 0) | ((error == 0) & (scaled % 2 == 1))), scaled - 1, scaled).astype(np.int64)
+        negative = (values < 0) & (scaled > 0)
+        whole, frac = np.divmod(scaled, 10 ** precision)
+
+        max_digits = 11
+        digits = 1 + sum((whole >= 10 ** k).astype(np.int64) for k in range(1, max_digits))
+        commas = (digits - 1) // 3 if grouping else 0
+        tail = precision + 1 if precision else 0
+        length = negative + 1 + digits + commas + tail
+
+        # Sort rows by string length so every character lands in a fixed column within each block of equal-length rows
+        order = np.argsort(length.astype(np.uint8), kind='stable')
+        length, negative, whole, frac = length[order], negative[order], whole[order], frac[order]
+        sizes, counts = np.unique(length, return_counts=True)
+        bounds = np.concatenate(([0], np.cumsum(counts)))
+        chars = np.zeros((values.size, int(sizes.max())), dtype=np.uint8)
+
+        # Peel off digits with float division, exact for integers this small and much faster than int64 // and %
+        def Digits(number, count):
+            number = number.astype(np.float64)
+            for _ in range(count):
+                quotient = np.floor(number / 10)
+                yield (number - quotient * 10).astype(np.uint8) + ord('0')
+                number = quotient
+
+        # Writes the character sitting offset places from the end of each string
+        def Put(offset, char):
+            for size, lo, hi in zip(sizes, bounds[:-1], bounds[1:]):
+                position = size - 1 - offset
+                if position >= 0:
+                    chars[lo:hi, position] = char if np.isscalar(char) else char[lo:hi]
+
+        offset = 0
+        for digit in Digits(frac, precision):
+            Put(offset, digit)
+            offset += 1
+        if precision:
+            Put(offset, ord('.'))
+            offset += 1
+        for k, digit in enumerate(Digits(whole, int(digits.max()))):
+            if grouping and k and k % 3 == 0:
+                Put(offset, ord(','))
+                offset += 1
+            Put(offset, digit)
+            offset += 1
+
+        # Leading '$'/'-$' overwrite the spill-over of shorter numbers' zero digits, then rows go back to input order
+        chars[:, 0] = np.where(negative, ord('-'), ord('$'))
+        chars[negative, 1] = ord('$')
+        inverse = np.empty_like(order)
+        inverse[order] = np.arange(values.size)
+        width = chars.shape[1]
+        final = chars[inverse].view('S%d' % width).ravel().astype('U%d' % width)
+
+        spec = (',' if grouping else '') + '.%df' % precision
+        if not simple.all():
+            final = final.astype(object)
+            for i in np.flatnonzero(~simple):
+                final[i] = ('-$' + format(-values[i], spec)) if values[i] < 0 else ('$' + format(values[i], spec))
         return final
 
-    # Converts future value dollars to present value dollars
+    # Converts future value dollars to present value dollars | list, n and i broadcast, so each item may have its own horizon and rate
     def InflationAdj(self, list, n, i):
-        final = []
-        for item in list:
-            adj = item * (1 + i) ** (-n)
-            final.append(adj)
-        return final
+        final = np.asarray(list, dtype=np.float64) * (1 + np.asarray(i, dtype=np.float64)) ** (-np.asarray(n, dtype=np.float64))
+        if isinstance(list, np.ndarray) or np.ndim(final) == 0:
+            return final
+        return final.tolist()
+
+    # Deflates a forecast to today's dollars, each year by its own horizon, in one broadcasted operation
+    # forecast is (years,), (years, vehicles) or (households, years, vehicles) | horizons default to each row's year index
+    # inflation is a constant rate, a per-year path of length >= max horizon, or one path per household (households, years)
+    def RealValues(self, forecast, inflation=0.02, horizons=None):
+
+        frame = forecast if isinstance(forecast, pd.DataFrame) else None
+        values = np.asarray(forecast, dtype=np.float64)
+        axis = 0 if values.ndim < 3 else 1
+        years = values.shape[axis]
+        horizons = np.arange(years) if horizons is None else np.asarray(horizons, dtype=np.int64)
+
+        inflation = np.asarray(inflation, dtype=np.float64)
+        if inflation.ndim == 0:
+            deflator = (1 + inflation) ** horizons
+        else:
+            # Price level after t years of a path is the product of its first t annual rates
+            levels = np.concatenate((np.ones(inflation.shape[:-1] + (1,)), np.cumprod(1 + inflation, axis=-1)), axis=-1)
+            deflator = levels[..., horizons]
+
+        # Line the year axis of the deflator up with the forecast's year axis
+        deflator = np.reshape(deflator, deflator.shape + (1,) * (values.ndim - axis - 1))
+        real = values / deflator
+        if frame is not None:
+            return pd.DataFrame(real, index=frame.index, columns=frame.columns)
+        return real
 
 class Visualization():
 
+    # Budget pie categories as (BudgetRecommendation index, label, color)
+    pie_fields = ((1, 'Federal Tax', '#ED9A88'), (4, 'State Tax', '#F0C3A2'), (5, 'Max Rent', '#A2C3F0'), (6, '401k', '#E5CCFF'),
+                  (7, 'ROTH IRA', '#8DF7C8'), (8, 'HSA', '#8DF3F7'), (9, 'Remaining', '#E5F78D'))
+
+    # Figure templates reused across clients, one per (size, dpi) in each process
+    templates = {}
+
     # Plots bar chart of financial forecast
     def BarChart(self, years_dict):
+        self.DrawBarChart(plt.gca(), years_dict)
+        plt.show()
+        return
 
-        # Initialize and unpack values
-        labels = years_dict.keys()
-        values = years_dict.values()
-        other = []
-        r_401k = []
-        r_roth = []
-        r_hsa = []
-        ind = [x for x, _ in enumerate(labels)]
-    
-        # Unwind dictionary into proper lists
-        for val in (x[0] for x in values):
-            other.append(val)
-        for val in (x[1] for x in values):
-            r_401k.append(val)
-        for val in (x[2] for x in values):
-            r_roth.append(val)
-        for val in (x[3] for x in values):
-            r_hsa.append(val)
-
-        r_401k = np.array(r_401k)
-        r_roth = np.array(r_roth)
-        r_hsa = np.array(r_hsa)
-            
-        plt.bar(ind, r_401k, width=0.5, label='401k', color='gold', bottom=r_roth+r_hsa)
-        plt.bar(ind, r_roth, width=0.5, label='ROTH IRA', color='red', bottom=r_hsa)
-        plt.bar(ind, r_hsa, width=0.5, label='HSA', color='blue')
-
-        plt.xticks(ind, labels)
-        plt.ylabel('Balance')
-        plt.xlabel('Year')
-        plt.legend(loc='upper right')
-        plt.title('Net Worth Until Retirement')
+    # Plots the budget pie chart of a BudgetRecommendation
+    def PieChart(self, recommendation):
+        fig, ax = plt.subplots()
+        self.DrawPieChart(ax, recommendation)
+        plt.tight_layout()
         plt.show()
-        return
\ No newline at end of file
+        return
+
+    # Returns (labels, (years, 4) balances of other, 401k, ROTH IRA, HSA) from a Forecast dict or ForecastResult, a DataFrame or a
+    # (years, 4) array | years past a Batch household's horizon (NaN) are dropped
+    def Balances(self, forecast):
+        if isinstance(forecast, dict):
+            labels = list(forecast.keys())
+            values = np.array(list(forecast.values()), dtype=np.float64).reshape(-1, 4)
+        elif isinstance(forecast, pd.DataFrame):
+            labels = list(forecast.index)
+            values = forecast.to_numpy(dtype=np.float64)
+        else:
+            values = np.asarray(forecast, dtype=np.float64).reshape(-1, 4)
+            labels = list(range(len(values)))
+        keep = ~np.isnan(values).any(axis=1)
+        return [label for label, kept in zip(labels, keep) if kept], values[keep]
+
+    # Draws the stacked retirement vehicle bars on ax
+    def DrawBarChart(self, ax, forecast):
+        labels, values = self.Balances(forecast)
+        ind = np.arange(len(labels))
+        r_401k, r_roth, r_hsa = values[:, 1], values[:, 2], values[:, 3]
+
+        ax.bar(ind, r_401k, width=0.5, label='401k', color='gold', bottom=r_roth+r_hsa)
+        ax.bar(ind, r_roth, width=0.5, label='ROTH IRA', color='red', bottom=r_hsa)
+        ax.bar(ind, r_hsa, width=0.5, label='HSA', color='blue')
+
+        ax.set_xticks(ind, labels)
+        ax.set_ylabel('Balance')
+        ax.set_xlabel('Year')
+        ax.legend(loc='upper right')
+        ax.set_title('Net Worth Until Retirement')
+
+    # Draws the budget donut of a BudgetRecommendation tuple or 12-value array on ax
+    def DrawPieChart(self, ax, recommendation):
+        if len(recommendation) != len(RecommendationResult.fields):
+            raise ValueError('A recommendation has %d values, got %d' % (len(RecommendationResult.fields), len(recommendation)))
+        values = [max(float(recommendation[i]), 0) for i, _, _ in self.pie_fields]
+        ax.pie(values, colors=[color for _, _, color in self.pie_fields], labels=[label for _, label, _ in self.pie_fields],
+               autopct='%1.1f%%', shadow=True, startangle=90)
+        ax.add_artist(patches.Circle((0, 0), 0.80, fc='white'))
+        ax.axis('equal')
+
+    # Returns this process's Agg figure for a size, created once and cleared before every use | never touches pyplot,
+    # so nothing needs a display and no figure is kept alive by pyplot's registry
+    def Template(self, size=(12, 5), dpi=100):
+        key = (tuple(size), dpi)
+        if key not in self.templates:
+            figure = Figure(figsize=size, dpi=dpi)
+            FigureCanvasAgg(figure)
+            self.templates[key] = figure
+        figure = self.templates[key]
+        figure.clear()
+        return figure
+
+    # Renders a client report (forecast bars and/or budget pie) headlessly | writes to path when given, otherwise returns
+    # the PNG/PDF/SVG bytes; format defaults to the path's extension
+    def Render(self, forecast=None, recommendation=None, path=None, format=None, size=(12, 5), dpi=100):
+        figure = self.Template(size, dpi)
+        charts = [chart for chart in (forecast, recommendation) if chart is not None]
+        axes = figure.subplots(1, len(charts), squeeze=False)[0]
+        if forecast is not None:
+            self.DrawBarChart(axes[0], forecast)
+        if recommendation is not None:
+            self.DrawPieChart(axes[-1], recommendation)
+        figure.tight_layout()
+
+        format = format or (os.path.splitext(path)[1][1:].lower() if path else 'png')
+        if path is not None:
+            figure.savefig(path, format=format)
+            figure.clear()
+            return path
+        with BytesIO() as buffer:
+            figure.savefig(buffer, format=format)
+            figure.clear()
+            return buffer.getvalue()
+
+    # Renders a list of (forecast, recommendation, path) jobs in one process with its template figure
+    @staticmethod
+    def RenderChunk(jobs, format=None, size=(12, 5), dpi=100):
+        v = Visualization()
+        return [v.Render(forecast, recommendation, path, format, size, dpi) for forecast, recommendation, path in jobs]
+
+    # Returns per-client recommendations from Batch.BudgetRecommendation() output (ResultColumns or its tuple of 12 field
+    # arrays, both laid out (fields, clients)), a (clients, 12) array or a list of per-client records
+    def Recommendations(self, recommendations):
+        if isinstance(recommendations, ResultColumns):
+            recommendations = recommendations.data.T
+        elif isinstance(recommendations, tuple) and all(isinstance(field, np.ndarray) for field in recommendations):
+            recommendations = np.stack(recommendations, axis=-1)
+        fields = len(RecommendationResult.fields)
+        for recommendation in recommendations:
+            if np.ndim(recommendation) != 1 or len(recommendation) != fields:
+                raise ValueError('Each recommendation needs %d values, got shape %s' % (fields, np.shape(recommendation)))
+        return list(recommendations)
+
+    # Renders one report per client across worker processes | forecasts is a (clients, years, 4) array such as Batch.Forecast()
+    # or a list of per-client forecasts, recommendations anything Recommendations accepts, paths one output file per client
+    # Returns the paths, or each client's image bytes when no paths are given; workers=1 renders in-process
+    def RenderMany(self, forecasts=None, recommendations=None, paths=None, format=None, workers=None, chunk_size=50, size=(12, 5), dpi=100):
+        recommendations = None if recommendations is None else self.Recommendations(recommendations)
+        clients = len(forecasts) if forecasts is not None else len(recommendations)
+        for name, values in (('recommendations', recommendations), ('paths', paths)):
+            if values is not None and len(values) != clients:
+                raise ValueError('Got %d %s for %d clients' % (len(values), name, clients))
+        jobs = list(zip([None] * clients if forecasts is None else forecasts,
+                        [None] * clients if recommendations is None else recommendations,
+                        [None] * clients if paths is None else paths))
+        chunks = [jobs[i:i + chunk_size] for i in range(0, clients, chunk_size)]
+        render = functools.partial(Visualization.RenderChunk, format=format, size=size, dpi=dpi)
+
+        if workers == 1:
+            results = [render(chunk) for chunk in chunks]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = Profiler.Map(executor, render, chunks)
+        return [result for chunk in results for result in chunk]
+
+class Profiler():
+
+    # Opt-in instrumentation of the model's call graph | with Profiler() as p: ... then p.Report() or p.JSON()
+    # The timing hooks are compiled into the model classes once at import (see Instrument) and only check the module's profiling
+    # count until a Profiler is entered, so they can stay in production runs. Each thread records into the Profilers it entered
+    # itself, nested Profilers each see the calls made inside them, and Sweep and RenderMany workers report back through Map.
+    # Times are cumulative wall time including nested calls; calls of a memoized method that never reach its body are cache hits
+    local = threading.local()
+
+    def __init__(self):
+        self.stats = {}
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        global profiling
+        active = getattr(Profiler.local, 'active', None)
+        if active is None:
+            active = Profiler.local.active = []
+        active.append(self)
+        profiling += 1
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global profiling
+        self.elapsed += time.perf_counter() - self.start
+        Profiler.local.active.remove(self)
+        profiling -= 1
+        return False
+
+    # Returns the Profilers entered by the calling thread
+    @classmethod
+    def Active(cls):
+        return getattr(cls.local, 'active', None) or []
+
+    # Wraps every function, staticmethod and classmethod defined on target with a timing hook named 'Class.method'
+    @classmethod
+    def Instrument(cls, target):
+        for name, attr in list(vars(target).items()):
+            if name.startswith('__'):
+                continue
+            if isinstance(attr, (staticmethod, classmethod)):
+                setattr(target, name, type(attr)(cls.Hook(target.__name__ + '.' + name, attr.__func__)))
+            elif isinstance(attr, types.FunctionType):
+                setattr(target, name, cls.Hook(target.__name__ + '.' + name, attr))
+
+    # Returns func wrapped to add its call count and wall time to the active Profilers | memoized methods are re-memoized around a
+    # hook on the undecorated method that counts cache misses
+    @classmethod
+    def Hook(cls, name, func):
+
+        if getattr(func, 'memoized', False):
+            inner = func.__wrapped__
+
+            @functools.wraps(inner)
+            def miss(*args, **kwargs):
+                if profiling:
+                    for profiler in cls.Active():
+                        profiler.Add(name, 'cache_misses', 1)
+                return inner(*args, **kwargs)
+            func = memoize(miss)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiling:
+                return func(*args, **kwargs)
+            active = cls.Active()
+            if not active:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                for profiler in active:
+                    profiler.Add(name, 'calls', 1)
+                    profiler.Add(name, 'seconds', elapsed)
+        return wrapper
+
+    # Adds value to one counter of stats[name]
+    def Add(self, name, field, value):
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = {'calls': 0, 'seconds': 0.0}
+        stats[field] = stats.get(field, 0) + value
+
+    # Adds the stats of another Profiler, e.g. one that ran in a worker process
+    def Merge(self, stats):
+        for name, counters in stats.items():
+            for field, value in counters.items():
+                self.Add(name, field, value)
+
+    # executor.map(func, items) that, while the calling thread profiles, runs each item under a Profiler in the worker and merges
+    # the workers' stats into the caller's Profilers
+    @classmethod
+    def Map(cls, executor, func, items):
+        active = list(cls.Active())
+        if not active:
+            return list(executor.map(func, items))
+        results = []
+        for result, stats in executor.map(functools.partial(cls.Collect, func), items):
+            for profiler in active:
+                profiler.Merge(stats)
+            results.append(result)
+        return results
+
+    # Runs func(item) under a fresh Profiler and returns (result, stats)
+    @staticmethod
+    def Collect(func, item):
+        with Profiler() as profiler:
+            result = func(item)
+        return result, profiler.stats
+
+    # Returns {'elapsed': seconds, 'functions': {name: {calls, seconds, per_call[, cache_hits, cache_misses]}}} for every
+    # function that was called, slowest first
+    def Report(self):
+        functions = {}
+        for name, stats in sorted(self.stats.items(), key=lambda item: -item[1]['seconds']):
+            if stats['calls']:
+                row = {'calls': stats['calls'], 'seconds': stats['seconds'], 'per_call': stats['seconds'] / stats['calls']}
+                if 'cache_misses' in stats:
+                    row['cache_hits'] = stats['calls'] - stats['cache_misses']
+                    row['cache_misses'] = stats['cache_misses']
+                functions[name] = row
+        return {'elapsed': self.elapsed, 'functions': functions}
+
+    # Returns the report as JSON, also writing it to path when one is given
+    def JSON(self, path=None):
+        report = json.dumps(self.Report(), indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+# Number of Profiler blocks open in this process | the compiled-in hooks do nothing else while it is 0
+profiling = 0
+
+for target in (Budget, Batch, Simulation, Sweep, Solver, IncrementalForecast, Drawdown, TaxTables, TaxEngine, Tools, Visualization):
+    Profiler.Instrument(target)
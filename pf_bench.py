@@ -0,0 +1,147 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+import personalfinance as pf
+
+# Headless benchmark suite for the Budget and Tools hot paths
+# Usage: python pf_bench.py --output bench.json [--baseline baseline.json --threshold 0.25] [--sizes 1 1000 1000000]
+
+# Repeatable household fixture | lognormal salaries around $75k, seeded so every run times the same inputs
+def Households(size, years_to_retirement=35, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'salary': np.round(rng.lognormal(np.log(75000), 0.5, size), 2),
+                         'years_worked': rng.integers(0, 20, size),
+                         'years_to_retirement': np.full(size, years_to_retirement),
+                         'years_to_live': np.full(size, 25),
+                         'necessity_pct': rng.uniform(0.4, 0.8, size)})
+
+# Builds one Budget per fixture row
+def Budgets(df):
+    return [pf.Budget(row.salary, row.years_worked, row.years_to_retirement, row.years_to_live, row.necessity_pct) for row in df.itertuples()]
+
+# Times func (best of repeat) and measures its peak traced memory in a separate run | func performs ops operations per call
+# setup runs untimed before every call, e.g. to clear the Budget caches so each run measures cold calls
+def Measure(name, func, ops, repeat=3, setup=None):
+    seconds = float('inf')
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        seconds = min(seconds, time.perf_counter() - start)
+
+    if setup:
+        setup()
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'name': name, 'ops': ops, 'seconds': seconds, 'ops_per_sec': ops / seconds if seconds else float('inf'), 'peak_mb': peak / 1e6}
+
+# Scalar cases run the Budget/Tools methods once per fixture row, the same way pf_test.py drives them
+def ScalarCases(size, horizons):
+    df = Households(size)
+    budgets = Budgets(df)
+    t = pf.Tools()
+    salaries = df['salary'].tolist()
+    pairs = list(zip(budgets, salaries))
+    recs = [b.BudgetRecommendation(s) for b, s in pairs]
+    nets = [b.NetWorth(r[6], r[7], r[8], r[9] * b.savings_rate) for b, r in zip(budgets, recs)]
+    label = '[scalar=%d]' % size
+
+    cases = [('FederalIncomeTax' + label, lambda: [b.FederalIncomeTax(s * 1.01) for b, s in pairs]),
+             ('StateIncomeTax' + label, lambda: [b.StateIncomeTax(s * 1.01) for b, s in pairs]),
+             ('SSMCRTax' + label, lambda: [b.SSMCRTax(s * 1.01) for b, s in pairs]),
+             ('Retirement' + label, lambda: [b.Retirement(b.necessity_pct * 1.01) for b in budgets]),
+             ('BudgetRecommendation' + label, lambda: [b.BudgetRecommendation(s) for b, s in pairs]),
+             ('NetWorth' + label, lambda: [b.NetWorth(r[6], r[7], r[8], r[9] * b.savings_rate) for b, r in zip(budgets, recs)]),
+             ('RetirementIncome' + label, lambda: [b.RetirementIncome(n[1], n[2], n[4]) for b, n in zip(budgets, nets)]),
+             ('Tools.AIME' + label, lambda: [t.AIME(b.salary, b.salary_inc, b.years_worked, b.years_to_retirement) for b in budgets]),
+             ('Tools.InflationAdj' + label, lambda: [t.InflationAdj(n, b.years_to_retirement, b.inflation) for b, n in zip(budgets, nets)])]
+
+    for years in horizons:
+        horizon = Budgets(Households(size, years))
+        budgets = budgets + horizon
+        cases.append(('Forecast%s[years=%d]' % (label, years), lambda horizon=horizon: [b.Forecast() for b in horizon]))
+
+    def setup():
+        for b in budgets:
+            b.ClearCache()
+    return [(name, func, size, setup) for name, func in cases]
+
+# Batch cases run the vectorized engines over the whole fixture in one call
+def BatchCases(size, horizons):
+    df = Households(size)
+    batch = pf.Batch(df)
+    t = pf.Tools()
+    salaries = df['salary'].to_numpy()
+    r = batch.BudgetRecommendation()
+    n = batch.NetWorth(r[6], r[7], r[8], r[9] * batch.savings_rate)
+    label = '[batch=%d]' % size
+
+    cases = [('FederalIncomeTax' + label, lambda: pf.TaxEngine.Federal(salaries)),
+             ('StateIncomeTax' + label, lambda: pf.TaxEngine.State(salaries)),
+             ('SSMCRTax' + label, lambda: pf.TaxEngine.FICA(salaries)),
+             ('Retirement' + label, lambda: batch.Retirement()),
+             ('BudgetRecommendation' + label, lambda: batch.BudgetRecommendation()),
+             ('NetWorth' + label, lambda: batch.NetWorth(r[6], r[7], r[8], r[9] * batch.savings_rate)),
+             ('RetirementIncome' + label, lambda: batch.RetirementIncome(n[1], n[2], n[4])),
+             ('Tools.InflationAdj' + label, lambda: t.InflationAdj(n[0], 35, 0.02))]
+
+    for years in horizons:
+        horizon = pf.Batch(Households(size, years))
+        cases.append(('Forecast%s[years=%d]' % (label, years), lambda horizon=horizon: horizon.Forecast()))
+    return [(name, func, size, None) for name, func in cases]
+
+# Returns the benchmarks whose ops/sec fell more than threshold below the baseline
+def Compare(results, baseline, threshold):
+    previous = {result['name']: result for result in baseline['results']}
+    regressions = []
+    for result in results:
+        if result['name'] in previous:
+            slowdown = previous[result['name']]['ops_per_sec'] / result['ops_per_sec'] - 1
+            if slowdown > threshold:
+                regressions.append((result['name'], slowdown))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the Budget and Tools hot paths')
+    parser.add_argument('--output', default='bench_results.json', help='where to write the JSON results')
+    parser.add_argument('--baseline', help='JSON results of a previous run to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25, help='allowed slowdown vs the baseline (0.25 = 25%%)')
+    parser.add_argument('--scalar-sizes', type=int, nargs='+', default=[1, 100], help='households per scalar benchmark')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 1000, 100000], help='households per batch benchmark (up to 1000000)')
+    parser.add_argument('--horizons', type=int, nargs='+', default=[10, 35, 60], help='forecast horizons in years')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    cases = []
+    for size in args.scalar_sizes:
+        cases += ScalarCases(size, args.horizons)
+    for size in args.sizes:
+        cases += BatchCases(size, args.horizons)
+
+    results = []
+    for name, func, ops, setup in cases:
+        result = Measure(name, func, ops, args.repeat, setup)
+        results.append(result)
+        print('%-55s %14.1f ops/sec %10.2f MB' % (name, result['ops_per_sec'], result['peak_mb']))
+
+    with open(args.output, 'w') as f:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = Compare(results, json.load(f), args.threshold)
+        for name, slowdown in regressions:
+            print('REGRESSION: %s is %.0f%% slower than baseline' % (name, slowdown * 100))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+import argparse
+import contextlib
+import os
+import sys
+import time
+import numpy as np
+import pandas as pd
+import personalfinance as pf
+
+# Streaming bulk recomputation | reads household inputs from CSV/Parquet in row chunks, runs the Batch model and appends results
+# Usage: python pf_bulk.py households.csv results.parquet [--chunk-size 100000] [--forecast] [--progressive] [--profile profile.json]
+# Input columns follow Batch: salary, years_worked, years_to_retirement, years_to_live, necessity_pct plus any optional Budget arguments
+
+# Returns True for the columns Batch reads | every other input column is passed through to the output as text
+def IsModelColumn(column):
+    return column in pf.Batch.required or column in pf.Batch.defaults
+
+# Yields DataFrame chunks of the input file without ever holding the whole file in memory
+# Passthrough columns are read as strings, so a column that is empty for the first chunk and text in a later one keeps one type
+def ReadChunks(path, chunk_size):
+    if os.path.splitext(path)[1].lower() == '.parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            columns = [column if IsModelColumn(name) else column.cast(pa.string()) for name, column in zip(batch.schema.names, batch.columns)]
+            yield pa.RecordBatch.from_arrays(columns, batch.schema.names).to_pandas()
+    else:
+        header = pd.read_csv(path, nrows=0).columns
+        yield from pd.read_csv(path, chunksize=chunk_size, dtype={column: 'string' for column in header if not IsModelColumn(column)})
+
+# Casts the Batch input columns to the dtypes Batch uses and the passthrough columns to strings, so every chunk has the same
+# schema whatever pandas inferred for it (e.g. int64 salaries in one chunk and float64 salaries with cents in the next)
+def Conform(chunk):
+    columns = {column: pf.Batch.dtypes.get(column, np.float64) if IsModelColumn(column) else 'string' for column in chunk.columns}
+    chunk = chunk.astype(columns)
+    if 'state' in columns:
+        chunk['state'] = chunk['state'].astype(str)
+    return chunk
+
+# Appends result chunks to a CSV or Parquet file, writing the header/schema with the first chunk
+# Parquet needs pyarrow; CSV uses pyarrow's writer when it is installed (much faster than DataFrame.to_csv) and pandas otherwise
+# Chunks go to a temporary file next to the output, which Close renames into place, so a failed run never leaves a partial output
+class ChunkWriter():
+
+    def __init__(self, path):
+        self.target = path
+        self.path = path + '.partial'
+        self.parquet = os.path.splitext(path)[1].lower() == '.parquet'
+        self.writer = None
+        self.schema = None
+        self.file = None
+        self.first = True
+        try:
+            import pyarrow
+            self.arrow = True
+        except ImportError:
+            if self.parquet:
+                raise
+            self.arrow = False
+
+    def Write(self, df):
+        if self.arrow:
+            import pyarrow as pa
+            import pyarrow.csv as pc
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if self.writer is None:
+                self.schema = table.schema
+                if self.parquet:
+                    self.writer = pq.ParquetWriter(self.path, table.schema)
+                else:
+                    self.file = open(self.path, 'wb')
+                    self.writer = pc.CSVWriter(self.file, table.schema)
+            else:
+                # Later chunks may infer different dtypes (e.g. int vs float), so conform them to the first chunk's schema
+                table = table.cast(self.schema)
+            self.writer.write_table(table)
+        else:
+            df.to_csv(self.path, mode='w' if self.first else 'a', header=self.first, index=False)
+        self.first = False
+
+    # Finishes the file and moves it to the output path
+    def Close(self):
+        self.Release()
+        if not self.first:
+            os.replace(self.path, self.target)
+
+    # Drops the temporary file after a failure, leaving any previous output untouched
+    def Abort(self):
+        self.Release()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    # Closes the open writer and file
+    def Release(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run BudgetRecommendation, NetWorth and RetirementIncome over a file of households')
+    parser.add_argument('input', help='CSV or Parquet file of household parameters')
+    parser.add_argument('output', help='CSV or Parquet file to write results to')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows per chunk')
+    parser.add_argument('--forecast', action='store_true', help='add the final Forecast year balances')
+    parser.add_argument('--progressive', action='store_true', help='use bracketed instead of flat top-bracket taxes')
+    parser.add_argument('--quiet', action='store_true', help='do not print progress')
+    parser.add_argument('--profile', help='write a per-function call count and timing report (JSON) to this path')
+    args = parser.parse_args(argv)
+
+    writer = ChunkWriter(args.output)
+    profiler = pf.Profiler() if args.profile else contextlib.nullcontext()
+    rows = 0
+    start = time.perf_counter()
+    try:
+        with profiler:
+            for chunk in ReadChunks(args.input, args.chunk_size):
+                chunk = Conform(chunk.reset_index(drop=True))
+                results = pf.Batch(chunk, args.progressive).Run(forecast=args.forecast)
+                writer.Write(pd.concat([chunk, results], axis=1))
+
+                rows += len(chunk)
+                if not args.quiet:
+                    elapsed = time.perf_counter() - start
+                    print('%d rows | %.1fs | %.0f rows/sec' % (rows, elapsed, rows / elapsed if elapsed else 0), file=sys.stderr)
+    except BaseException:
+        writer.Abort()
+        raise
+    writer.Close()
+
+    if args.profile:
+        profiler.JSON(args.profile)
+
+    if not args.quiet:
+        elapsed = time.perf_counter() - start
+        print('Done: %d rows written to %s in %.1fs' % (rows, args.output, elapsed), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,4 +1,3 @@
-from matplotlib import pyplot as plt
 import personalfinance as pf
 import numpy as np
 import pandas as pd
@@ -85,24 +84,4 @@ f = b.Forecast()
 v.BarChart(f)
 
 # Pie Chart
-categories = ['Federal Tax', 'State Tax', 'Max Rent', '401k', 'ROTH IRA', 'HSA', 'Remaining']
-variables = r[1:]
-
-# Colors
-colors = ['#ED9A88', '#F0C3A2', '#A2C3F0', '#E5CCFF', '#8DF7C8', '#8DF3F7', '#E5F78D']
-
-# Explode
-explode = (0, 0, 0, 0, 0, 0, 0)
-
-fig1, ax1 = plt.subplots()
-ax1.pie(variables, explode = explode, colors = colors, labels = categories, autopct = '%1.1f%%', shadow = True, startangle = 90)
-
-# Draw circle
-center_circle = plt.Circle((0,0), 0.80, fc='white')
-fig = plt.gcf()
-fig.gca().add_artist(center_circle)
-
-# Equal aspect ratio ensures that pie is drawn as a circle
-ax1.axis('equal')
-plt.tight_layout()
-plt.show()
+v.PieChart(r)